@@ -11,6 +11,7 @@ import time
 import os
 import atexit
 import sys
+import threading
 from collections import OrderedDict
 import ansistrm
 import descriptors as desc
@@ -22,6 +23,10 @@ import terminalsize
 import decoders as dec
 from devices import TxAPI
 from devices import RxAPI
+from devices import flush_trace
+from devices import DATALOG
+from devices import METRICS
+from devices import TRACE_EVENTS
 import utils
 import datalog
 import testprofile
@@ -238,6 +243,79 @@ class RACompleter(object):
         # Return the completion
         return response
 
+class SamplingProfiler(object):
+    """
+    Samples the stack of every Python thread from a background thread
+
+    Each sample walks sys._current_frames(), so time spent in the ctypes
+    callbacks (_py_rd_func, _py_wr_func, ...) shows up under the SWM_* call
+    that invoked them. dump() writes collapsed stacks, one
+    'thread;outer;...;inner count' line per distinct stack, as read by
+    flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = {}
+        self._labels = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        self._stacks = {}
+        self.samples = 0
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = "%s (%s:%d)" % (
+                code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+        return label
+
+    def _run(self):
+        own = threading.current_thread().ident
+        while not self._stop.wait(self.interval):
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            for (ident, frame) in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ';'.join(reversed(stack))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def dump(self, filename):
+        """Writes the collapsed stacks to filename, returns the number of stacks"""
+        stacks = self._stacks.items()
+        with open(filename, 'w') as f:
+            for (stack, count) in sorted(stacks):
+                f.write("%s %d\n" % (stack, count))
+        return len(stacks)
+
 class RAConsole(object):
     def __init__(self, logging_level,
             interactive=True,
@@ -293,6 +371,7 @@ class RAConsole(object):
         self.__current_command_list = []
         self.__exit_app = False
         self.__trace = False
+        self.__profiler = SamplingProfiler()
 
         print "Initializing..."
 #        if(self.__interactive):
@@ -309,7 +388,10 @@ class RAConsole(object):
             self.__tx_dev.set_trace(self.__trace)
             try:
                 line = raw_input("ra:z%d> " % self.__tx_dev['zone'])
-                self._dispatch(line.strip())
+                try:
+                    self._dispatch(line.strip())
+                finally:
+                    flush_trace()
                 if(self.__exit_app == True):
                     break
             except KeyboardInterrupt as info:
@@ -759,6 +841,82 @@ class RAConsole(object):
         else:
             time.sleep(sleep_time)
 
+    @config('app', [['start', 'stop', 'dump'], [_dirs]])
+    def profile(self, action=None, arg=None):
+        """Sample all threads and write flamegraph stacks.
+
+        usage: profile start [<interval_ms>]
+               profile stop
+               profile dump <file>
+
+        'start' clears previous samples. 'dump' writes collapsed stacks
+        for flamegraph.pl or speedscope; it may be used while running.
+        """
+        if action == 'start':
+            if arg is not None:
+                self.__profiler.interval = float(arg) / 1000
+            self.__profiler.stop()
+            self.__profiler.reset()
+            self.__profiler.start()
+            print "Profiling every %.1f ms" % (self.__profiler.interval * 1000)
+        elif action == 'stop':
+            self.__profiler.stop()
+            print "Stopped after %d samples" % self.__profiler.samples
+        elif action == 'dump' and arg is not None:
+            stacks = self.__profiler.dump(arg)
+            print "Wrote %d stacks (%d samples) to %s" % (stacks, self.__profiler.samples, arg)
+        elif action is None:
+            print "%s, %d samples" % (
+                'running' if self.__profiler.running else 'stopped', self.__profiler.samples)
+        else:
+            print(self.help('profile'))
+
+    @config('app', [['start', 'stop', 'dump'], [_dirs]])
+    def events(self, action=None, filename=None):
+        """Record device transactions as Chrome trace events.
+
+        usage: events start
+               events stop
+               events dump <file>
+
+        Every library call and com port callback is recorded as a span.
+        Open the dumped file in chrome://tracing or ui.perfetto.dev.
+        """
+        if action in ['start', 'stop']:
+            enable = (action == 'start')
+            self.__tx_dev.set_trace_events(enable)
+            self.__rx_devs.set_trace_events(enable)
+            if enable:
+                TRACE_EVENTS.start()
+            else:
+                TRACE_EVENTS.stop()
+                print "Recorded %d events" % len(TRACE_EVENTS)
+        elif action == 'dump' and filename is not None:
+            count = TRACE_EVENTS.write(filename)
+            print "Wrote %d events to %s" % (count, filename)
+        elif action is None:
+            print "%s, %d events" % (
+                'recording' if TRACE_EVENTS.enabled else 'stopped', len(TRACE_EVENTS))
+        else:
+            print(self.help('events'))
+
+    @config('app', [['reset']])
+    def stats(self, action=None):
+        """Display per-method, per-device API call metrics.
+
+        usage: stats [reset]
+
+        Lists call, retry and error counts with latency percentiles,
+        most total time first. 'reset' clears the counters.
+        """
+        if action is None:
+            for line in METRICS.report():
+                print line
+        elif action == 'reset':
+            METRICS.reset()
+        else:
+            print(self.help('stats'))
+
     @config('app', [['disable','enable']])
     def trace(self, state='blank'):
         """Display SummitAPI calls and opcodes used by Ra commands.
@@ -1210,6 +1368,10 @@ class RAConsole(object):
             )
             if self.__datalog is not None:
                 print "Cleaning up..."
+                DATALOG.flush()
+                self.__logger.debug("datalog: %r" % DATALOG.stats)
+                if DATALOG.stats['failed']:
+                    self.__logger.warning("%d datalog records could not be written" % DATALOG.stats['failed'])
                 self.__datalog.complete_run()
         except Exception, info:
             self.__logger.critical("Test system failure")
@@ -1217,6 +1379,7 @@ class RAConsole(object):
             self.__logger.error(traceback.print_exc())
         finally:
             if self.__datalog is not None:
+                DATALOG.flush()
                 self.__datalog.disable()
             # Turn off power to slave outlets
             self.__logger.debug("Shutting off all power outlets")
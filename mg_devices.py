@@ -1,11 +1,16 @@
 import math
 import utils
+import atexit
 import os.path
 import re
+import json
 import time
+import random
 import sys
 import array
 import ctypes
+import ctypes.util
+import threading
 import testprofile
 import decoders as dec
 import descriptors as desc
@@ -19,6 +24,13 @@ try:
     import usb
 except ImportError:
     usb = None
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
 
 from datetime import datetime
 from blinker import signal
@@ -30,44 +42,862 @@ from termcolor import cprint, colored
 
 FLASH_BUFFER_LENGTH = 128
 
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2 has no monotonic clock, read CLOCK_MONOTONIC through librt
+    class _timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        _clock_gettime = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1').clock_gettime
+    except (OSError, AttributeError):
+        _clock_gettime = None
+
+    def monotonic():
+        if _clock_gettime is None:
+            return time.time()
+        ts = _timespec()
+        _clock_gettime(1, ctypes.byref(ts)) # CLOCK_MONOTONIC
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+class LatencyHistogram(object):
+    """
+    Compact log-bucketed latency histogram
+
+    Bucket boundaries grow by 2**(1/SUB_BUCKETS) (~9%) starting at
+    RESOLUTION seconds, so percentiles are accurate to one bucket width
+    while only occupied buckets are stored.
+    """
+    SUB_BUCKETS = 8
+    RESOLUTION = 1e-6
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds < self.RESOLUTION:
+            index = 0
+        else:
+            index = int(math.log(seconds / self.RESOLUTION, 2) * self.SUB_BUCKETS) + 1
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for (index, count) in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def _upper(self, index):
+        return self.RESOLUTION * 2 ** (index / float(self.SUB_BUCKETS))
+
+    def percentile(self, p):
+        """Returns the latency (seconds) at or below which p percent fall"""
+        if self.count == 0:
+            return 0.0
+        target = max(1, int(math.ceil(p / 100. * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._upper(index), self.max)
+        return self.max
+
+class MethodMetrics(object):
+    """Counters for one (method, mac) pair of the metrics registry"""
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.statuses = {}
+        self.total = 0.0
+        self.latency = LatencyHistogram()
+        self.gave_up = {}
+
+    @property
+    def errors(self):
+        """Number of attempts that did not return success (0x01)"""
+        return sum(count for (status, count) in self.statuses.items() if status != 0x01)
+
+class MetricsRegistry(object):
+    """
+    Call, retry, status and latency counters for the API layer
+
+    The datalog decorators record every decorated call here, keyed by
+    (method name, device MAC). Latency is measured around the whole call,
+    retries and backoff included; every attempt's status is counted. Calls
+    that failed are also counted by the reason the retry policy stopped
+    ('exhausted', 'not_retryable', 'deadline' or 'budget').
+
+    | Example:
+    |  from pysummit.devices import METRICS
+    |  ...
+    |  for line in METRICS.report():
+    |      print line
+    |  METRICS.reset()
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def record(self, method, mac, statuses, elapsed, gave_up=None):
+        """Records one call; statuses holds the status of every attempt"""
+        key = (method, mac)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = MethodMetrics()
+            entry.calls += 1
+            entry.retries += len(statuses) - 1
+            for status in statuses:
+                entry.statuses[status] = entry.statuses.get(status, 0) + 1
+            entry.total += elapsed
+            entry.latency.add(elapsed)
+            if gave_up is not None:
+                entry.gave_up[gave_up] = entry.gave_up.get(gave_up, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+
+    def items(self):
+        """Returns [((method, mac), MethodMetrics), ...], most total time first"""
+        with self._lock:
+            items = self._entries.items()
+        return sorted(items, key=lambda item: item[1].total, reverse=True)
+
+    def report(self):
+        """Returns the registry formatted as a list of table lines"""
+        lines = ["{:<32} {:<17} {:>7} {:>7} {:>7} {:>9} {:>9} {:>9} {:>9}".format(
+            'method', 'mac', 'calls', 'retries', 'errors', 'p50_ms', 'p99_ms', 'max_ms', 'total_s')]
+        for ((method, mac), entry) in self.items():
+            lines.append("{:<32} {:<17} {:>7} {:>7} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                method, mac or '-', entry.calls, entry.retries, entry.errors,
+                entry.latency.percentile(50) * 1000,
+                entry.latency.percentile(99) * 1000,
+                entry.latency.max * 1000,
+                entry.total))
+            failed = sorted(status for status in entry.statuses if status != 0x01)
+            if failed:
+                lines.append("    " + ", ".join(
+                    "0x%.2X: %d" % (status, entry.statuses[status]) for status in failed))
+            if entry.gave_up:
+                lines.append("    gave up: " + ", ".join(
+                    "%s: %d" % (reason, entry.gave_up[reason]) for reason in sorted(entry.gave_up)))
+        return lines
+
+METRICS = MetricsRegistry()
+
+# Host side I/O errors returned by the com port callbacks
+IO_STATUS_CODES = frozenset(range(0xE1, 0xE9))
+
+# Firmware statuses reporting a transient condition, by their names in
+# dec.system_status_tx and dec.system_status_rx
+TRANSIENT_STATUS_NAMES = frozenset([
+    'Busy',
+    'Device busy',
+    'Timeout',
+    'Command timed out',
+])
+
+def transient_statuses(status_table, names=TRANSIENT_STATUS_NAMES):
+    """
+    Returns the codes in status_table whose name is one of names
+
+    | Arguments:
+    |  status_table -- dict of status -> name, e.g. dec.system_status_rx
+    |  names        -- names of the transient statuses
+    |
+    | Returns:
+    |  frozenset of status codes
+    """
+    codes = frozenset(status for (status, name) in status_table.items() if name in names)
+    if not codes:
+        logging.getLogger('Devices').warning(
+            "none of %s in the status table, only I/O errors will be retried" % sorted(names))
+    return codes
+
+TX_TRANSIENT_STATUSES = transient_statuses(dec.system_status_tx)
+RX_TRANSIENT_STATUSES = transient_statuses(dec.system_status_rx)
+
+class RetryBudget(object):
+    """
+    Process wide allowance of retries
+
+    Every call deposits ratio of a token and every retry withdraws a whole
+    one, so retries are held to roughly ratio of the traffic. On top of
+    that reserve tokens per second trickle in so that a quiet bench can
+    still retry. The balance never exceeds limit.
+    """
+
+    def __init__(self, ratio=0.2, reserve=10, limit=100):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.limit = limit
+        self._balance = float(limit)
+        self._last = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self._balance = min(self.limit, self._balance + (now - self._last) * self.reserve)
+        self._last = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._balance = min(self.limit, self._balance + self.ratio)
+
+    def withdraw(self):
+        """Takes one retry from the budget; returns False if it is spent"""
+        with self._lock:
+            self._refill()
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+    @property
+    def balance(self):
+        with self._lock:
+            self._refill()
+            return self._balance
+
+RETRY_BUDGET = RetryBudget()
+
+class RetryPolicy(object):
+    """
+    Decides whether and when the retry decorators try a failed call again
+
+    The number of retries still comes from get_retries(). A failed attempt
+    is only retried when its status is retryable, the call's deadline has
+    not passed and the shared budget allows it. Retries back off
+    exponentially from base_delay up to max_delay, scaled down by a random
+    factor of up to jitter.
+
+    | Arguments:
+    |  retryable  -- set of statuses to retry, None for the calling API's
+    |                retryable_statuses (IO_STATUS_CODES plus its
+    |                TX_/RX_TRANSIENT_STATUSES)
+    |  base_delay -- delay before the first retry, in seconds
+    |  max_delay  -- upper bound on any one delay, in seconds
+    |  jitter     -- fraction of each delay that is randomised (0-1)
+    |  deadline   -- seconds after which a call is not retried, None for no limit
+    |  budget     -- RetryBudget shared with other policies, None for no limit
+    |
+    | Example:
+    |  from pysummit.devices import TxAPI, RetryPolicy
+    |  Tx = TxAPI()
+    |  Tx.retry_policy = RetryPolicy(base_delay=0.05, deadline=2)
+    """
+
+    def __init__(self, retryable=None, base_delay=0.005, max_delay=0.25, jitter=0.5,
+                 deadline=None, budget=RETRY_BUDGET):
+        self.retryable = None if retryable is None else frozenset(retryable)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.budget = budget
+
+    def backoff(self, attempt):
+        """Returns the delay before retry number attempt (0 based)"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (1 - self.jitter * random.random())
+
+    def next_delay(self, caller, status, attempt, started):
+        """
+        Returns (delay, None) if the failed attempt should be retried after
+        delay seconds, otherwise (None, reason)
+        """
+        retryable = self.retryable
+        if retryable is None:
+            retryable = getattr(caller, 'retryable_statuses', IO_STATUS_CODES)
+        if status not in retryable:
+            return (None, 'not_retryable')
+        delay = self.backoff(attempt)
+        if self.deadline is not None and (monotonic() + delay - started) > self.deadline:
+            return (None, 'deadline')
+        if self.budget is not None and not self.budget.withdraw():
+            return (None, 'budget')
+        return (delay, None)
+
+def _caller_mac(caller):
+    try:
+        return caller['mac']
+    except (KeyError, IndexError, TypeError):
+        return None
+
+class TraceEventLog(object):
+    """
+    Records device transactions as Chrome trace events
+
+    While enabled, every call through a TracedTarget and every com port
+    callback is recorded as a complete ('X') event. Events on one thread
+    nest by time, so the wr_func/rd_func spans show up inside the SWM_*
+    call that issued them. write() produces a JSON file for
+    chrome://tracing or ui.perfetto.dev.
+
+    | Example:
+    |  from pysummit.devices import TRACE_EVENTS
+    |  TRACE_EVENTS.start()
+    |  Tx.set_trace_events(True)
+    |  Tx.load_fw_from_file('fw.bin')
+    |  TRACE_EVENTS.stop()
+    |  TRACE_EVENTS.write('load_fw.json')
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._origin = monotonic()
+
+    def __len__(self):
+        return len(self._events)
+
+    def start(self):
+        """Clears any recorded events and starts recording"""
+        with self._lock:
+            self._events = []
+            self._threads = {}
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def complete(self, name, start, end, cat='io', **args):
+        """Records a span from start to end (monotonic() seconds)"""
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': (start - self._origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': args,
+            }
+        with self._lock:
+            self._events.append(event)
+            self._threads[thread.ident] = thread.name
+
+    def write(self, filename):
+        """Writes the recorded events to filename, returns the event count"""
+        with self._lock:
+            events = list(self._events)
+            threads = self._threads.items()
+        pid = os.getpid()
+        for (tid, name) in threads:
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                           'args': {'name': name}})
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events) - len(threads)
+
+TRACE_EVENTS = TraceEventLog()
+
+class LockedTarget(object):
+    """
+    Proxy around an API's ctypes library holding the API's library_lock
+    for the duration of every call
+
+    Each SWM library is opened once through SWM_Open with a single set of
+    callbacks, and nothing establishes that it is reentrant, so calls from
+    other threads (e.g. the executors of the async facades) enter it one at
+    a time. The lock is reentrant, so callbacks may call back into the API.
+    """
+
+    def __init__(self, lib, lock):
+        self.lib = lib
+        self.lock = lock
+
+    def __getattr__(self, name):
+        fn = getattr(self.lib, name)
+        if not callable(fn):
+            return fn
+        lock = self.lock
+
+        def locked(*args):
+            with lock:
+                return fn(*args)
+        setattr(self, name, locked)
+        return locked
+
+class TracedTarget(object):
+    """
+    Proxy around an API's ctypes library recording a span per call
+
+    Installed by API.set_trace_events(); each span carries the device MAC
+    and the returned status.
+    """
+
+    def __init__(self, lib, api):
+        self.lib = lib
+        self._api = api
+
+    def __getattr__(self, name):
+        fn = getattr(self.lib, name)
+        if not callable(fn):
+            return fn
+        api = self._api
+
+        def traced(*args):
+            if not TRACE_EVENTS.enabled:
+                return fn(*args)
+            status = None
+            start = monotonic()
+            try:
+                status = fn(*args)
+                return status
+            finally:
+                TRACE_EVENTS.complete(name, start, monotonic(), 'swm',
+                    mac=_caller_mac(api),
+                    status='0x%.2X' % status if isinstance(status, (int, long)) else status)
+        return traced
+
+def trace_span(name):
+    """Records the decorated com port callback as a trace event span"""
+    def wrapped_top(fn):
+        @wraps(fn)
+        def wrapped(*args, **kwargs):
+            if not TRACE_EVENTS.enabled:
+                return fn(*args, **kwargs)
+            start = monotonic()
+            status = fn(*args, **kwargs)
+            TRACE_EVENTS.complete(name, start, monotonic(), status=status)
+            return status
+        return wrapped
+    return wrapped_top
+
+class FrameReader(object):
+    """
+    Reads Summit protocol frames from a ComPort through a reusable buffer
+
+    Whatever the port has waiting is pulled into one bytearray, the
+    0x01 0x01 header is located with find() and the frame is cut out
+    through a memoryview, instead of hunting for the header one read(1)
+    at a time. A frame is the 9 byte header (payload length in bytes 7-8,
+    little endian) followed by the payload.
+
+    read_frame() returns (status, frame) where status is 0 or one of the
+    I/O codes used by the read callbacks:
+    | 0xE1 -- timed out before a header was found
+    | 0xE2 -- timed out reading the header
+    | 0xE3 -- timed out reading the payload
+    | 0xE5 -- more than max_scan bytes discarded looking for a header
+    """
+    HEADER = b'\x01\x01'
+    HEADER_LENGTH = 9
+
+    def __init__(self, com, max_scan=None):
+        self.com = com
+        self.max_scan = max_scan
+        self._buf = bytearray()
+
+    def clear(self):
+        del self._buf[:]
+
+    def _fill(self, needed=1):
+        """Reads at least needed bytes, more if already waiting"""
+        waiting = self.com.target.inWaiting()
+        data = self.com.read(max(needed, waiting))
+        self._buf.extend(data)
+        return len(data) >= needed
+
+    def _fill_to(self, length):
+        missing = length - len(self._buf)
+        return missing <= 0 or self._fill(missing)
+
+    def read_frame(self):
+        buf = self._buf
+        tracing = TRACE_EVENTS.enabled
+        if tracing:
+            mark = monotonic()
+
+        scanned = 0
+        start = buf.find(self.HEADER)
+        while start < 0:
+            # A trailing 0x01 may be the first half of the header
+            keep = 1 if buf[-1:] == self.HEADER[:1] else 0
+            scanned += len(buf) - keep
+            del buf[:len(buf) - keep]
+            if self.max_scan is not None and scanned > self.max_scan:
+                return (0xE5, None)
+            if not self._fill():
+                return (0xE1, None)
+            start = buf.find(self.HEADER)
+        del buf[:start]
+        if tracing:
+            now = monotonic()
+            TRACE_EVENTS.complete('frame sync', mark, now, discarded=scanned + start)
+            mark = now
+
+        if not self._fill_to(self.HEADER_LENGTH):
+            return (0xE2, None)
+        data_len = buf[7] + (buf[8] << 8)
+        end = self.HEADER_LENGTH + data_len
+        if not self._fill_to(end):
+            return (0xE3, None) # READ_PAYLOAD_ERROR
+        frame = memoryview(buf)[:end].tobytes()
+        del buf[:end]
+        if tracing:
+            TRACE_EVENTS.complete('payload read', mark, monotonic(), length=data_len)
+        return (0, frame)
+
+class Transport(object):
+    """
+    Com port backend behind an API's open/close/wr/rd callbacks
+
+    write() sends a message and transact() sends one and parses the reply
+    into it in place, both returning 0 or an I/O status code. callbacks()
+    returns the (open_func, close_func, wr_func, rd_func) function pointers
+    handed to the library; by default these are the API's own callbacks,
+    which dispatch to the transport of the current device.
+
+    | Example:
+    |  from pysummit.devices import TxAPI
+    |  Tx = TxAPI(com=comport.ComPort('/dev/ttyUSB0'))
+    |  print Tx['transport'].com_type
+    """
+    com_type = None
+
+    def __init__(self, com=None):
+        self.com = com
+
+    def open(self):
+        return 0
+
+    def close(self):
+        return 0
+
+    def write(self, mes):
+        raise NotImplementedError
+
+    def transact(self, mes):
+        raise NotImplementedError
+
+    def callbacks(self, api):
+        """Returns the library callbacks for api"""
+        return (api.ACCESS_FUNC(api._py_open_func),
+                api.ACCESS_FUNC(api._py_close_func),
+                api.IO_FUNC(api._py_wr_func),
+                api.IO_FUNC(api._py_rd_func))
+
+class UartTransport(Transport):
+    """
+    Summit protocol over a comport.ComPort
+
+    The port is locked for the whole transaction; replies are scanned by a
+    FrameReader that is kept for the life of the transport.
+    """
+    com_type = 'UART'
+
+    def __init__(self, com, max_scan=None):
+        super(UartTransport, self).__init__(com)
+        self.reader = FrameReader(com, max_scan)
+
+    def open(self):
+        return self.com.connect()
+
+    def close(self):
+        return self.com.close()
+
+    def write(self, mes):
+        status = 0x0
+        self.com.lock_port()
+        try:
+            if(self.com.isOpen()):
+                message = mes[0].to_pkt()
+                bytes_written = self.com.write(message)
+                if(len(message) != bytes_written):
+                    status = 0xE1
+            else:
+                logging.getLogger('Devices').warning("%s is *NOT* open" % self.com.target.port)
+        finally:
+            self.com.unlock_port()
+        return status
+
+    def transact(self, mes):
+        self.com.lock_port()
+        try:
+            tracing = TRACE_EVENTS.enabled
+            if tracing:
+                mark = monotonic()
+            self.com.target.flushInput()
+            self.reader.clear()
+            message = mes[0].to_pkt()
+
+            bytes_written = self.com.write(message)
+            if(len(message) != bytes_written):
+                return 0xE1
+            if tracing:
+                TRACE_EVENTS.complete('uart write', mark, monotonic())
+
+            (status, message) = self.reader.read_frame()
+            if(status != 0):
+                return status
+            try:
+                mes[0].from_pkt(message)
+            except TargetPacketError as info:
+                return 0xE4
+            return status
+        finally:
+            self.com.unlock_port()
+
+class UsbTransport(Transport):
+    """
+    Summit protocol over USB control transfers
+
+    com is the pyusb device, (re)discovered by find(). Replies are read
+    into a preallocated buffer.
+    """
+    com_type = 'USB'
+    READ_LENGTH = 500
+
+    def __init__(self, vendor_id, product_id):
+        super(UsbTransport, self).__init__(None)
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self._buf = array.array('B', [0] * self.READ_LENGTH)
+
+    def find(self):
+        self.com = usb.core.find(idVendor=self.vendor_id, idProduct=self.product_id)
+        return self.com
+
+    def write(self, mes):
+        try:
+            status = 0xE6  # was E1
+            message = mes[0].to_pkt()
+            bytes_written = self.com.ctrl_transfer(0x22, 0x03, 0, 0, message, 1000)
+            if(len(message) == bytes_written):
+                status = 0
+        except:
+            pass
+        return status
+
+    def transact(self, mes):
+        try:
+            status = 0xE7  # was E1
+            message = mes[0].to_pkt()
+            bytes_written = self.com.ctrl_transfer(0x22, 0x03, 0, 0, message, 1000)
+            if(len(message) == bytes_written):
+                length = self.com.ctrl_transfer(0xa2, 0x03, 0, 0, self._buf, 10000)
+                try:
+                    status = 0xE8 # was E3
+                    mes[0].from_pkt(self._buf[:length].tostring())
+                except TargetPacketError as info:
+                    pass
+                except:
+                    raise
+            status = 0
+        except:
+            pass
+        return status
+
+class I2cTransport(Transport):
+    """
+    Summit protocol over the Raspberry Pi BSP I2C driver
+
+    The driver's C functions are handed to the library directly, so I2C
+    transactions never enter Python.
+    """
+    com_type = 'I2C'
+
+    def __init__(self, bsp):
+        super(I2cTransport, self).__init__(None)
+        self.bsp = bsp
+
+    def open(self):
+        return self.bsp.target.I2C_Open()
+
+    def close(self):
+        return self.bsp.target.I2C_Close()
+
+    def write(self, mes):
+        return self.bsp.target.I2C_Write(mes)
+
+    def transact(self, mes):
+        return self.bsp.target.I2C_Read(mes)
+
+    def callbacks(self, api):
+        return (api.ACCESS_FUNC(self.bsp.target.I2C_Open),
+                api.ACCESS_FUNC(self.bsp.target.I2C_Close),
+                api.IO_FUNC(self.bsp.target.I2C_Write),
+                api.IO_FUNC(self.bsp.target.I2C_Read))
+
+_datalog_add = signal('datalog_add')
+_datalog_add_batch = signal('datalog_add_batch')
+
+class DatalogSink(object):
+    """
+    Buffer between the datalog decorators and the database
+
+    API calls put() raw records (ints and an epoch timestamp) in the buffer
+    and return straight away; once batch_size records have collected, and
+    on flush(), they are formatted and written on the calling thread. A
+    batch goes out as one 'datalog_add_batch' signal
+    (records=[(mac, fields), ...]) so a receiver can insert it in a single
+    transaction, or as individual 'datalog_add' signals when nothing is
+    connected to the batch signal. Writing on the caller's thread keeps
+    receivers holding thread bound handles (e.g. the sqlite3 connection of
+    datalog.DataLog) working, so flush() must be called before the run is
+    completed. Callers should check active() first and skip capturing the
+    record altogether when nobody is listening. Records whose write raised
+    are counted in stats['failed'].
+
+    | Example:
+    |  from pysummit.devices import DATALOG
+    |  ...
+    |  DATALOG.flush()  # before completing the run
+    |  print DATALOG.stats
+    """
+
+    def __init__(self, batch_size=256):
+        self.batch_size = batch_size
+        self.stats = {'queued': 0, 'written': 0, 'failed': 0, 'batches': 0}
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def active(self):
+        """Returns True if anything is connected to the datalog signals"""
+        return bool(_datalog_add.receivers or _datalog_add_batch.receivers)
+
+    def put(self, mac, name, exp, act, cmd=None, retry=None, timestamp=None):
+        """Buffers a record; exp and act are raw status ints, timestamp is time.time()"""
+        record = (mac, name, exp, act, cmd, retry, timestamp)
+        with self._lock:
+            self._buffer.append(record)
+            self.stats['queued'] += 1
+            if len(self._buffer) < self.batch_size:
+                return
+            batch = self._take()
+        self._deliver(batch)
+
+    def flush(self):
+        """Writes every buffered record to the receivers"""
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._deliver(batch)
+
+    def _take(self):
+        batch = self._buffer
+        self._buffer = []
+        return batch
+
+    def _deliver(self, batch):
+        try:
+            failed = self._write(batch)
+        except Exception:
+            logging.getLogger('Devices').exception("datalog write failed")
+            failed = len(batch)
+        with self._lock:
+            self.stats['written'] += len(batch) - failed
+            self.stats['failed'] += failed
+            self.stats['batches'] += 1
+
+    @staticmethod
+    def _format(record):
+        (mac, name, exp, act, cmd, retry, timestamp) = record
+        fields = {'name': name, 'exp': '0x%.2X' % exp, 'act': '0x%.2X' % act}
+        if cmd is not None:
+            fields['cmd'] = cmd
+        if retry is not None:
+            fields['retry'] = retry
+        if timestamp is not None:
+            fields['timestamp'] = str(datetime.utcfromtimestamp(timestamp))
+        return (mac, fields)
+
+    def _write(self, batch):
+        """Sends batch to the receivers; returns the number of records that failed"""
+        records = [self._format(record) for record in batch]
+        if _datalog_add_batch.receivers:
+            _datalog_add_batch.send(self, records=records)
+            return 0
+        failed = 0
+        for (mac, fields) in records:
+            try:
+                _datalog_add.send(mac, **fields)
+            except Exception:
+                logging.getLogger('Devices').exception("datalog write failed")
+                failed += 1
+        return failed
+
+DATALOG = DatalogSink()
+atexit.register(DATALOG.flush)
+
 def retry_datalog(fn):
     """
-    Retrys the decorated method on failure, logging details to database
+    Retrys the decorated method on failure as allowed by the caller's
+    retry_policy, logging details to database
     """
 
     @wraps(fn)
     def wrapped(*args, **kwargs):
-        add_log = signal('datalog_add')
         caller = args[0]
+        policy = caller.retry_policy
         tries = caller.get_retries() + 1
+        log = DATALOG.active()
+        statuses = []
+        gave_up = None
+        started = monotonic()
+        if policy.budget is not None:
+            policy.budget.deposit()
         for retry in range(tries):
-            not_last_retry = (retry != tries-1)
-            dt_now = datetime.utcnow()
+            if log:
+                timestamp = time.time()
             (status, ret) = fn(*args, **kwargs)
+            statuses.append(status)
             if(status == 0x01):
-                if caller.log_errors_only:
-                    pass
-                else:
-                    add_log.send(caller['mac'], name=fn.__name__, exp='0x%.2X'%0x01, act="0x%.2X"%status, cmd=1, retry=0, timestamp=str(dt_now))
+                if log and not caller.log_errors_only:
+                    DATALOG.put(caller['mac'], fn.__name__, 0x01, status, cmd=1, retry=0, timestamp=timestamp)
                 break
+            if retry == tries-1:
+                (delay, gave_up) = (None, 'exhausted')
             else:
-                add_log.send(caller['mac'], name=fn.__name__, exp='0x%.2X'%0x01, act="0x%.2X"%status, cmd=1, retry=int(not_last_retry), timestamp=str(dt_now))
+                (delay, gave_up) = policy.next_delay(caller, status, retry, started)
+            if log:
+                DATALOG.put(caller['mac'], fn.__name__, 0x01, status, cmd=1, retry=int(delay is not None), timestamp=timestamp)
+            if delay is None:
+                break
+            time.sleep(delay)
+        if METRICS.enabled:
+            METRICS.record(fn.__name__, _caller_mac(caller), statuses, monotonic() - started, gave_up)
         return (status, ret)
     return wrapped
 
 def retry(fn):
     """
-    Retrys the decorated method on failure
+    Retrys the decorated method on failure as allowed by the caller's
+    retry_policy
     """
 
     @wraps(fn)
     def wrapped(*args, **kwargs):
         caller = args[0]
+        policy = caller.retry_policy
         tries = caller.get_retries() + 1
+        started = monotonic()
+        if policy.budget is not None:
+            policy.budget.deposit()
         for retry in range(tries):
             (status, ret) = fn(*args, **kwargs)
-            if(status == 0x01):
+            if(status == 0x01) or (retry == tries-1):
+                break
+            (delay, gave_up) = policy.next_delay(caller, status, retry, started)
+            if delay is None:
                 break
+            time.sleep(delay)
         return (status, ret)
     return wrapped
 
@@ -77,15 +907,18 @@ def datalog(fn):
     """
     @wraps(fn)
     def wrapped(*args, **kwargs):
-        not_last_retry = 0
-        add_log = signal('datalog_add')
         caller = args[0]
-        dt_now = datetime.utcnow()
+        log = DATALOG.active()
+        if log:
+            timestamp = time.time()
+        started = monotonic()
         (status, ret) = fn(*args, **kwargs)
-        if caller.log_errors_only and (status == 0x01):
+        if METRICS.enabled:
+            METRICS.record(fn.__name__, _caller_mac(caller), (status,), monotonic() - started)
+        if not log or (caller.log_errors_only and (status == 0x01)):
             pass
         else:
-            add_log.send(caller['mac'], name=fn.__name__, exp='0x%.2X'%0x01, act='0x%.2X'%status, cmd=1, retry=0, timestamp=str(dt_now))
+            DATALOG.put(caller['mac'], fn.__name__, 0x01, status, cmd=1, retry=0, timestamp=timestamp)
 
         return (status, ret)
     return wrapped
@@ -102,47 +935,106 @@ def increase_timeout(timeout=3):
         return wrapped
     return wrapped_top
 
+# Picks the main and secondary opcodes out of an API method docstring
+TRACE_OPCODES_RE = re.compile(
+    '.*?(Main:).*?((?:[a-z][a-z]*[0-9]+[a-z0-9]*))'
+    '.*?(Secondary:).*?((?:[a-z][a-z]*[0-9]+[a-z0-9]*))',
+    re.IGNORECASE|re.DOTALL)
+
+# Trace lines are buffered and written out in blocks by flush_trace()
+TRACE_BUFFER_LINES = 64
+_trace_buffer = []
+
+def flush_trace():
+    """Writes out any buffered trace lines"""
+    lines = _trace_buffer[:]
+    if lines:
+        del _trace_buffer[:len(lines)]
+        sys.stdout.write(colored('\n'.join(lines), 'green') + '\n')
+        sys.stdout.flush()
+
+atexit.register(flush_trace)
+
 def trace(fn):
     """
     Displays function name and argument list of the decorated function
 
+    The opcodes are extracted from the docstring once, at decoration time,
+    so while tracing is off the wrapper is a single attribute check.
     """
+    m = TRACE_OPCODES_RE.search(fn.__doc__ or '')
+    if m:
+        opcodes = 'M:0{} S:0{}'.format(m.group(2), m.group(4))
+    else:
+        opcodes = ''
+
+    @wraps(fn)
     def wrapped(*args, **kwargs):
-        caller = args[0]
-        if(caller.get_trace()):
-            func_text = '  ' +  fn.__name__ + '('
-            for arg in range(1, len(args)):
-                func_text += format(args[arg])
-                if (len(args) > 2 and arg < (len(args) - 1)):
-                    func_text += ','
-            func_text += ')  '
-
-            # extract opcodes from functions docstring text
-            re1='.*?'           # Non-greedy match on filler
-            re2='(Main:)'       # Literal match
-            re3='.*?'           # Non-greedy match on filler
-            re4='((?:[a-z][a-z]*[0-9]+[a-z0-9]*))'  # opcode as text
-            re5='.*?'           # Non-greedy match on filler
-            re6='(Secondary:)'  # Literal match
-            re7='.*?'           # Non-greedy match on filler
-            re8='((?:[a-z][a-z]*[0-9]+[a-z0-9]*))' # opcode as text
-            rg = re.compile(re1+re2+re3+re4+re5+re6+re7+re8,re.IGNORECASE|re.DOTALL)
-            m = rg.search(fn.__doc__)
-            if m:
-                op1=m.group(2)
-                op2=m.group(4)
-                opcodes = 'M:0{} S:0{}'.format(op1, op2)
-            else:
-                opcodes = ''
+        if args[0]._trace:
+            func_text = '  ' + fn.__name__ + '(' + ','.join([format(arg) for arg in args[1:]]) + ')  '
+            _trace_buffer.append('{:<45}{}'.format(func_text, opcodes))
+            if len(_trace_buffer) >= TRACE_BUFFER_LINES:
+                flush_trace()
+        return fn(*args, **kwargs)
+    return wrapped
 
-            trace_text = '{:<45}{}'.format(func_text, opcodes)
-            cprint (trace_text, 'green')
+class Progress(object):
+    """
+    Console progress line showing count, rate and ETA
+
+    update() only touches the terminal when at least interval seconds have
+    passed since the last redraw, so it is cheap enough to call once per
+    transaction in tight loops.
+
+    | Arguments:
+    |  label    -- text shown in front of the counters
+    |  total    -- expected final count, None if unknown (no ETA shown)
+    |  interval -- minimum seconds between redraws
+    |
+    | Example:
+    |  progress = Progress('Echo', total=500)
+    |  for i in range(500):
+    |      Tx.echo(0)
+    |      progress.update()
+    |  progress.close()
+    """
 
-        result = fn(*args, **kwargs)
-        return result
-    wrapped.__name = fn.__name__
-    wrapped.__doc__ = fn.__doc__
-    return wrapped
+    def __init__(self, label, total=None, interval=0.25, stream=None):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self._start = time.time()
+        self._next_draw = self._start + interval
+        self._width = 0
+
+    def update(self, count=1):
+        self.count += count
+        now = time.time()
+        if now >= self._next_draw:
+            self._next_draw = now + self.interval
+            self._draw(now)
+
+    def close(self):
+        """Draws the final counts and ends the progress line"""
+        self._draw(time.time())
+        self.stream.write('\n')
+        self.stream.flush()
+
+    def _draw(self, now):
+        elapsed = now - self._start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        if self.total:
+            remaining = max(self.total - self.count, 0)
+            eta = int(remaining / rate) if rate > 0 else 0
+            line = "%s %d/%d  %.1f/s  ETA %d:%02d" % (
+                self.label, self.count, self.total, rate, eta // 60, eta % 60)
+        else:
+            line = "%s %d  %.1f/s" % (self.label, self.count, rate)
+        self._width = max(self._width, len(line))
+        self.stream.write('\r' + line.ljust(self._width))
+        self.stream.flush()
 
 
 class API(object):
@@ -152,11 +1044,13 @@ class API(object):
     """
 
     def __init__(self, target, name):
-        self.target = target
+        self.library_lock = threading.RLock()
+        self.target = LockedTarget(target, self.library_lock)
         self.name = name
         self.IO_FUNC = ctypes.CFUNCTYPE(ctypes.c_ubyte, ctypes.POINTER(ms.MESSAGE))
         self.ACCESS_FUNC = ctypes.CFUNCTYPE(ctypes.c_ubyte)
         self._retries = 5
+        self.retry_policy = RetryPolicy()
         self._trace = False
         self._log_errors_only = False
 
@@ -173,6 +1067,30 @@ class API(object):
             raise TypeError("log_errors_only property must be True or False")
         self._log_errors_only = value
 
+    def _py_open_func(self):
+        return self['transport'].open()
+
+    def _py_close_func(self):
+        return self['transport'].close()
+
+    # Exceptions must not escape into the library: ctypes would only print
+    # them and hand the library an undefined status
+    @trace_span('wr_func')
+    def _py_wr_func(self, mes):
+        try:
+            return self['transport'].write(mes)
+        except Exception:
+            logging.getLogger('Devices').exception("wr_func failed")
+            return 0xE1
+
+    @trace_span('rd_func')
+    def _py_rd_func(self, mes):
+        try:
+            return self['transport'].transact(mes)
+        except Exception:
+            logging.getLogger('Devices').exception("rd_func failed")
+            return 0xE1
+
     def decode_error_status(self, status, cmd=None, print_on_error=False):
         ret = ""
         if status != 0x01:
@@ -218,8 +1136,42 @@ class API(object):
         |  Tx = TxAPI()
         |  Tx.set_trace(True)
         """
+        if self._trace and not enable:
+            flush_trace()
         self._trace = enable
 
+    def get_trace_events(self):
+        """
+        Returns True if library calls are recorded to TRACE_EVENTS
+
+        | Arguments: none
+        |
+        | Returns:
+        |  enable -- current state of trace event recording
+        """
+        return isinstance(self.target, TracedTarget)
+
+    def set_trace_events(self, enable):
+        """
+        Routes library calls through a TracedTarget so they are recorded
+        to TRACE_EVENTS while it is started
+
+        | Arguments:
+        |   enable -- True or False
+        |
+        | Returns: none
+        |
+        | Example:
+        |  from pysummit.devices import TxAPI, TRACE_EVENTS
+        |  Tx = TxAPI()
+        |  Tx.set_trace_events(True)
+        |  TRACE_EVENTS.start()
+        """
+        if enable and not isinstance(self.target, TracedTarget):
+            self.target = TracedTarget(self.target, self)
+        elif not enable and isinstance(self.target, TracedTarget):
+            self.target = self.target.lib
+
     def get_retries(self):
         """
         Returns current number of retries used by PySummit API methods
@@ -1418,6 +2370,7 @@ class API(object):
                 print "Firmware Image %d could not be erased (0x%.2X)" % (image, status)
                 return (status, None)
 
+            progress = Progress('Flash', total=file_size)
             total_byte_count = 0
             while(total_byte_count < file_size):
                 flashData = array.array('B', f.read(FLASH_BUFFER_LENGTH))
@@ -1435,19 +2388,17 @@ class API(object):
                     if(bytes_transferred > 0):
                         break
                     elif(attempt == attempts):
-                        self.logger.error('\nMax attempts exceeded')
+                        progress.close()
+                        self.logger.error('Max attempts exceeded')
                         print "Bytes to send: %d" % file_size
                         print "Bytes sent: %d" % total_byte_count
                         print "Attempt: %d" % attempt
                         return (status, None)
 
                 address += bytes_transferred
-                if(address != 0 and (address % (FLASH_BUFFER_LENGTH * 4)) == 0):
-                    sys.stdout.write('.')
-                    sys.stdout.flush()
+                progress.update(bytes_transferred)
 
-            sys.stdout.write('\n')
-            sys.stdout.flush()
+            progress.close()
 
             (status, image_ok) = self.check_active_image(slave, image)
             if((status == 0x01) and (image_ok == 1)):
@@ -1830,6 +2781,7 @@ class TxAPI(API):
         self.__dev = {
             'com': None,
             'com_type': None,
+            'transport': None,
             'port': None,
             'fw_major': "0.0",
             'fw_minor': "0.0",
@@ -1844,27 +2796,16 @@ class TxAPI(API):
         # Create dictionary with both Summit status
         self.status_codes = {}
         self.status_codes.update(dec.system_status_tx)
+        self.retryable_statuses = IO_STATUS_CODES | TX_TRANSIENT_STATUSES
 
         if isinstance(com, comport.ComPort):
 #            print "Connect to TX device via UART port %s" % com.target.port
             self.__dev['com'] = com
             self.__dev['port'] = com.target.port
-            self.__dev['com_type'] = 'UART'
+            self.__dev['transport'] = UartTransport(com, max_scan=500)
             self.status_codes.update(dec.serial_status)
             print "Using UART port {}".format(self.__dev['port'])
-            self.open_func = self.ACCESS_FUNC(self._py_uart_open_func)
-            self.logger.debug("open_func: %r" % self.open_func)
-
-            self.close_func = self.ACCESS_FUNC(self._py_uart_close_func)
-            self.logger.debug("close_func: %r" % self.close_func)
-
-            self.wr_func = self.IO_FUNC(self._py_uart_wr_func)
-            self.logger.debug("wr_func: %r" % self.wr_func)
-
-            self.rd_func = self.IO_FUNC(self._py_uart_rd_func)
-            self.logger.debug("rd_func: %r" % self.rd_func)
         elif com == 'usb':
-            self.__dev['com_type'] = 'USB'
             self.status_codes.update(dec.usb_status)
 
             # look for optional vendor and product ID arguments
@@ -1881,37 +2822,23 @@ class TxAPI(API):
                 print '\n<<< Using USB but optional vendor and product IDs missing or incorrect >>>\n'
                 raise Exception()
 
-            self.open_func = self.ACCESS_FUNC(self._py_usb_open_func)
-            self.logger.debug("open_func: %r" % self.open_func)
-
-            self.close_func = self.ACCESS_FUNC(self._py_usb_close_func)
-            self.logger.debug("close_func: %r" % self.close_func)
-
-            self.wr_func = self.IO_FUNC(self._py_usb_wr_func)
-            self.logger.debug("wr_func: %r" % self.wr_func)
-
-            self.rd_func = self.IO_FUNC(self._py_usb_rd_func)
-            self.logger.debug("rd_func: %r" % self.rd_func)
+            self.__dev['transport'] = UsbTransport(self.__dev['vendor_id'], self.__dev['product_id'])
         elif com == 'i2c':
-            self.__dev['com_type'] = 'I2C'
             self.status_codes.update(dec.i2c_status)
             print "Using I2C"
-            self.open_func = self.ACCESS_FUNC(self.bsp.target.I2C_Open)
-            self.logger.debug("open_func: %r" % self.open_func)
-
-            self.close_func = self.ACCESS_FUNC(self.bsp.target.I2C_Close)
-            self.logger.debug("close_func: %r" % self.close_func)
-
-            self.wr_func = self.IO_FUNC(self.bsp.target.I2C_Write)
-            self.logger.debug("wr_func: %r" % self.wr_func)
-
-            self.rd_func = self.IO_FUNC(self.bsp.target.I2C_Read)
-            self.logger.debug("rd_func: %r" % self.rd_func)
-
+            self.__dev['transport'] = I2cTransport(self.bsp)
         else:
             print 'No Tx Control interface specified'
             raise
 
+        self.__dev['com_type'] = self.__dev['transport'].com_type
+        (self.open_func, self.close_func, self.wr_func, self.rd_func) = \
+            self.__dev['transport'].callbacks(self)
+        self.logger.debug("open_func: %r" % self.open_func)
+        self.logger.debug("close_func: %r" % self.close_func)
+        self.logger.debug("wr_func: %r" % self.wr_func)
+        self.logger.debug("rd_func: %r" % self.rd_func)
+
         self.open(collect)
 
     def __getitem__(self, index):
@@ -1944,8 +2871,7 @@ class TxAPI(API):
 
         # (re) discover usb device
         if self.__dev['com_type'] == 'USB':
-            self.__dev['com'] = usb.core.find(idVendor=self.__dev['vendor_id'],\
-            idProduct=self.__dev['product_id'])
+            self.__dev['com'] = self.__dev['transport'].find()
 
         (status, md) = self.get_master_descriptor()
         if(status == 0x01):
@@ -2117,147 +3043,14 @@ class TxAPI(API):
 
 
 #==============================================================================
-# USB Callback functions
+# Callback functions
 #==============================================================================
-    def _py_usb_wr_func(self, mes):
-        """
-        Private method supporting write communication via USB interface
-        """
-        try:
-            status = 0xE6  # was E1
-            message = mes[0].to_pkt()
-            bytes_written = self.__dev['com'].ctrl_transfer(0x22, 0x03, 0, 0,  message, 1000)
-            if(len(message) == bytes_written):
-                status = 0
-        except:
-            pass
-        return status
-
-    def _py_usb_rd_func(self, mes):
-        """
-        Private method supporting read communication via USB interface
-        """
-        try:
-            status = 0xE7  # was E1
-            message = mes[0].to_pkt()
-            bytes_written = self.__dev['com'].ctrl_transfer(0x22, 0x03, 0, 0, message, 1000)
-            if(len(message) == bytes_written):
-                resp = self.__dev['com'].ctrl_transfer(0xa2, 0x03, 0, 0, 500, 10000)
-                try:
-                    status = 0xE8 # was E3
-                    mes[0].from_pkt(resp.tostring())
-                except TargetPacketError as info:
-                    pass
-                except:
-                    raise
-            status = 0
-        except:
-            pass
-        return status
-
-    def _py_usb_open_func(self):
-        """
-        Private method supporting opening communication via USB interface
-        """
-        return 0
-
-    def _py_usb_close_func(self):
-        """
-        Private method supporting closing communication via USB interface
-        """
-        return 0
-
     def _py_reset_func(self):
         """
         Private method supporting reset when using USB interface
         """
         return 0
 
-#==============================================================================
-# UART Callback functions
-#==============================================================================
-    def _py_uart_wr_func(self, mes):
-        status = 0x0
-        self['com'].lock_port()
-        try:
-            if(self['com'].isOpen()):
-                message = mes[0].to_pkt()
-                bytes_written = self['com'].write(message)
-                if(len(message) != bytes_written):
-                    status = 0xE1
-                else:
-                    status = 0
-            else:
-                print "self['com'] is *NOT* open"
-        except:
-            raise
-        finally:
-            self['com'].unlock_port()
-
-        return status
-
-    def _py_uart_rd_func(self, mes):
-        """Serial read method that searches for correct Summit protocol 1 byte
-        at a time.
-
-        """
-        self['com'].lock_port()
-        self['com'].target.flushInput()
-        message = mes[0].to_pkt()
-
-        bytes_written = self['com'].write(message)
-        if(bytes_written == 0):
-            self['com'].unlock_port()
-            return 0xE1
-        else:
-            status = 0
-
-        timeout_counter = 0
-        byte_count = 0
-        while(True): # Read until exception or return
-            timeout_counter += 1
-            if timeout_counter > 500:
-                return 0xE5
-
-            byte = self['com'].read(1)  # Tries to read until timeout
-            if(len(byte) != 1):
-                return 0xE1
-
-            if(byte_count == 0):
-                if(ord(byte) == 0x01):
-                    message = byte
-                    byte_count += 1
-            elif(byte_count > 0):
-                if((ord(byte) == 0x01) & (ord(message[0]) == 0x01)):
-                    message += byte
-                    byte_count += 1
-                    message += self['com'].read(7)
-                    if(len(message) != 9):
-                        return 0xE2
-                    else:
-                        data_len = ord(message[7]) + (ord(message[8])<<8)
-                        message += self['com'].read(data_len)
-
-                        try:
-                            mes[0].from_pkt(message)
-                        except TargetPacketError as info:
-                            self['com'].unlock_port()
-                            return 0xE4
-                        except:
-                            raise
-                        if(len(message) != (data_len+9)):
-                            self['com'].unlock_port()
-                            return 0xE3 # READ_PAYLOAD_ERROR
-
-                        self['com'].unlock_port()
-                        return status
-
-    def _py_uart_open_func(self):
-        return self.__dev['com'].connect()
-
-    def _py_uart_close_func(self):
-        return self['com'].close()
-
     def _py_uart_reset_func(self):
         return 0
 
@@ -4615,7 +5408,6 @@ class TxAPI(API):
         assert (count < 33)  # Max number of speakers is 32 for now
         slave_index = 0x00
         status = 0x02  # this should get overwritten (INVALID_CMD)
-        add_log = signal('datalog_add')
         tp = profile
 
         if(tp):
@@ -4632,18 +5424,18 @@ class TxAPI(API):
             if(status != 0x01):
                 self.decode_error_status(status, cmd='set_i2s_input_map')
 
-            sys.stdout.write('\n')
-            sys.stdout.write('Pushing')
+            log = DATALOG.active()
             if (count == 1):  # Push one speaker map at a time (pre-194.2)
+                progress = Progress('Pushing', total=slave_count)
                 for slave_index in range(slave_count):
-                    sys.stdout.write('.')
-                    sys.stdout.flush()
                     (status, null) = self.push_map(slave_index, speaker_map[slave_index], count)
+                    progress.update()
                     if (slave_index == slave_count-1): # last spkr should get 0x01 status
                         exp = 0x01
                     else:
                         exp = 0x9B
-                    add_log.send(self['mac'], name='push_map', exp="0x%.2X"%exp, act="0x%.2X"%status)
+                    if log:
+                        DATALOG.put(self['mac'], 'push_map', exp, status)
                     if (status != 0x01 and status != 0x9B):
                         logging.error(self.decode_error_status(status, cmd='push_map(%d, )' % 0))
             else:
@@ -4652,12 +5444,14 @@ class TxAPI(API):
                 for slave_index in range(slave_count):
                     map_info[slave_index] = speaker_map[slave_index]
 
+                progress = Progress('Pushing', total=slave_count)
                 (status, null) = self.push_map(0, map_info[0], len(map_info))
-                add_log.send(self['mac'], name='push_multi_map', exp="0x%.2X"%0x01, act="0x%.2X"%status)
+                progress.update(slave_count)
+                if log:
+                    DATALOG.put(self['mac'], 'push_multi_map', 0x01, status)
                 if (status != 0x01):
                     logging.error(self.decode_error_status(status, cmd='push_multi_map(%d, )' % 0))
-            sys.stdout.write('\n')
-            sys.stdout.flush()
+            progress.close()
         return (status, speaker_map)
 
     @trace
@@ -4865,6 +5659,69 @@ class TxAPI(API):
         return (radio_cal_status, cal_sm_state.value)
 
 
+class _ComCursor(threading.local):
+    """Per-thread device selection used by RxAPI"""
+    device = None
+
+MAC_RE = re.compile('..:..:..:..:..:..')
+
+def natural_key(text):
+    """Sort key that orders embedded numbers numerically (ttyUSB2 before ttyUSB10)"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split('([0-9]+)', text)]
+
+def mac_aliases(mac):
+    """Returns the lower case, dash separated and unseparated spellings of mac"""
+    dashed = mac.replace(':', '-')
+    plain = mac.replace(':', '')
+    return set([mac.lower(), dashed, dashed.lower(), plain, plain.lower()]) - set([mac])
+
+class RxDevice(object):
+    """
+    Handle on one slave of an RxAPI
+
+    Indexing reads and writes the slave's own metadata ('mac', 'com',
+    'port', ...). RxAPI methods called through the handle run with this
+    slave selected for the calling thread and under the slave's lock, so
+    handles can be used from several threads at once and are not affected
+    by other iterations over the RxAPI.
+
+    | Example:
+    |  from pysummit.devices import RxAPI
+    |  Rx = RxAPI(coms)
+    |  for rx in Rx:
+    |      (status, value) = rx.rd(0x403024)
+    |      print rx['mac'], value
+    """
+
+    def __init__(self, api, dev):
+        self.api = api
+        self.dev = dev
+        self.lock = threading.RLock()
+
+    def __getitem__(self, key):
+        return self.dev[key]
+
+    def __setitem__(self, key, value):
+        self.dev[key] = value
+
+    def __repr__(self):
+        return "<RxDevice %s on %s>" % (self.dev.get('mac'), self.dev.get('port'))
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            with self.lock:
+                previous = self.api._select(self)
+                try:
+                    return attr(*args, **kwargs)
+                finally:
+                    self.api._select(previous)
+        method.__name__ = name
+        return method
+
 class RxAPI(API):
     """
     PySummit system functions specific to control of Slave devices
@@ -4879,7 +5736,11 @@ class RxAPI(API):
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.getLogger().level)
         self.__devs = []
-        self.__com_index = -1
+        self.retryable_statuses = IO_STATUS_CODES | RX_TRANSIENT_STATUSES
+        self.__macs = {}
+        self.__aliases = {}
+        self.__user_aliases = {}
+        self.__cursor = _ComCursor()
         self.open_func = self.ACCESS_FUNC(self._py_open_func)
         self.close_func = self.ACCESS_FUNC(self._py_close_func)
         self.wr_func = self.IO_FUNC(self._py_wr_func)
@@ -4900,38 +5761,62 @@ class RxAPI(API):
         self.close_coms()
 
     def __getitem__(self, index):
+        """
+        RX[index] and RX[mac] (or an alias) return that slave's RxDevice handle
+        and select it for the calling thread; RX[key] reads metadata of the
+        selected slave (the last slave if the thread has not selected one)
+        """
         if(type(index) == type(1)):
             if(index < len(self)):
-                self.__com_index = index
-                return self
+                device = self.__devs[index]
             else:
                 raise IndexError
-        elif(re.match('..:..:..:..:..:..', index)):
-            self.__com_index = self.index(index)
-            return self
         else:
-            if(self.__com_index < len(self)):
-                return self.__devs[self.__com_index][index]
+            # Metadata keys ('transport', 'com', ...) are read on every
+            # transaction, so look them up before any MAC or alias
+            if self.__devs:
+                current = self._current()
+                if index in current.dev:
+                    return current.dev[index]
+            position = self.index(index)
+            if position is not None:
+                device = self.__devs[position]
+            elif MAC_RE.match(index):
+                raise KeyError(index)
             else:
-                raise IndexError
+                return self._current().dev[index]
+        self.__cursor.device = device
+        return device
 
     def __setitem__(self, index, value):
-        self.__devs[self.__com_index][index] = value
+        self._current().dev[index] = value
 
-    def __iter__(self):
-        self.__com_index = -1
-        return self
-
-    def next(self):
+    def _current(self):
         """
-        Returns next instance of slave device
+        Returns the slave selected by the calling thread; like the original
+        index cursor, which started at -1, an unselected thread gets the
+        last slave
         """
+        device = self.__cursor.device
+        if device is None:
+            if not self.__devs:
+                raise IndexError
+            device = self.__devs[-1]
+        return device
 
-        self.__com_index += 1
-        if(self.__com_index >= len(self.__devs)):
-            self.__com_index = -1
-            raise StopIteration
-        return self
+    def __iter__(self):
+        """Yields the RxDevice handle of every slave, selecting each in turn"""
+        previous = self.__cursor.device
+        for device in list(self.__devs):
+            self.__cursor.device = device
+            yield device
+        self.__cursor.device = previous
+
+    def _select(self, device):
+        """Makes device the current slave of the calling thread, returns the previous one"""
+        previous = self.__cursor.device
+        self.__cursor.device = device
+        return previous
 
 #    def __getitem__(self, index):
 #        self._set_port(index)
@@ -4941,11 +5826,41 @@ class RxAPI(API):
         return len(self.__devs)
 
     def __contains__(self, item):
-        """Membership testing via MACs"""
-        for dev in self:
-            if(item == self['mac']):
-                return True
-        return False
+        """Membership testing via MACs and aliases"""
+        return item in self.__macs or item in self.__aliases
+
+    def _index_devs(self):
+        """Rebuilds the MAC and alias lookups after the device list changes"""
+        self.__macs = {}
+        self.__aliases = {}
+        for (position, dev) in enumerate(self.__devs):
+            if dev['mac'] is not None:
+                self.__macs[dev['mac']] = position
+                for alias in mac_aliases(dev['mac']):
+                    self.__aliases[alias] = dev['mac']
+        for (alias, mac) in self.__user_aliases.items():
+            if mac in self.__macs:
+                self.__aliases[alias] = mac
+
+    def add_alias(self, alias, mac):
+        """
+        Lets a slave be addressed by another name, e.g. Rx['sub'] or 'sub.' in ra
+
+        | Arguments:
+        |  alias -- name to use
+        |  mac   -- MAC address of the slave
+        |
+        | Returns: none
+        |
+        | Example:
+        |  from pysummit.devices import RxAPI
+        |  Rx = RxAPI(coms)
+        |  Rx.add_alias('sub', '02:EA:4C:00:00:13')
+        |  print Rx['sub']['port']
+        """
+        self.__user_aliases[alias] = mac
+        if mac in self.__macs:
+            self.__aliases[alias] = mac
 
     def index(self, mac):
         """
@@ -4966,9 +5881,10 @@ class RxAPI(API):
         |  get_our_mac(), id()
         """
 
-        for dev in self:
-            if(mac == self['mac']):
-                return self.__com_index
+        position = self.__macs.get(mac)
+        if position is None and mac in self.__aliases:
+            position = self.__macs.get(self.__aliases[mac])
+        return position
 
 #    def _set_port(self, index):
 #        if(index > len(self.__devs)-1):
@@ -4976,54 +5892,103 @@ class RxAPI(API):
 #        else:
 #            self.com_index = index
 
+    def broadcast(self, method, *args, **kwargs):
+        """
+        Calls the named API method on every slave in turn
+
+        The slaves are not serviced concurrently: SWMRXAPI.so is opened once
+        per process and is not known to be reentrant, so only one slave
+        transaction can be in flight at a time.
+
+        | Arguments:
+        |  method -- name of the RxAPI method to call
+        |  args   -- arguments passed on to the method
+        |
+        | Returns:
+        |  results -- list of method return values, in slave order
+        |
+        | Example:
+        |  from pysummit.devices import RxAPI
+        |  Rx = RxAPI(coms)
+        |  for (status, ns) in Rx.broadcast('netstat', 0):
+        |      print ns
+        """
+
+        return [getattr(device, method)(*args, **kwargs) for device in list(self.__devs)]
+
+    # Seconds to wait for a candidate port to answer the OUR_MAC0 read
+    PROBE_TIMEOUT = 0.5
+
+    def _probe(self, dev):
+        """Returns True if dev answers the OUR_MAC0 read like a Summit device"""
+        if not dev['com'].connect():
+            return False
+        # Do a quick check for OUR_MAC0. Try to not flood the connected
+        # device with data, it may not be a Summit device.
+        target = dev['com'].target
+        timeout = target.timeout
+        target.timeout = self.PROBE_TIMEOUT
+        try:
+            (rd_status, our_mac0) = dev.rd(0x403024)
+        finally:
+            target.timeout = timeout
+        return (rd_status == 0x01) and (our_mac0 == 0xEA02)
+
+    def _describe(self, dev):
+        """Fills in the metadata of a responding device, returns True on success"""
+        (smd_status, smd) = dev.get_speaker_module_descriptor()
+        (sd_status, sd) = dev.get_speaker_descriptor()
+        logging.debug("smd_status: %d" % smd_status)
+        logging.debug("sd_status: %d" % sd_status)
+        logging.debug("smd.hardwareType: %d" % smd.hardwareType)
+        if((smd_status == 0x01) and (sd_status == 0x01)):
+            major = smd.firmwareVersion >> 5   # (Upper 11-bits)
+            minor = smd.firmwareVersion & 0x1f # (Lower 5-bits)
+            dev['fw_major'] = major
+            dev['fw_minor'] = minor
+            dev['fw_version'] = "%d.%d" % (major, minor)
+            dev['mac'] = ":".join(["%.2X" % i for i in smd.macAddress])
+            dev['speaker_type'] = sd.staticSpeakerType
+            dev['type'] = 'slave'
+            dev['module_id'] = smd.moduleID
+            return True
+        return False
+
     def _prune_devs(self):
         """
         Checks status of all connected devices, removes those that fail to respond
+
+        Ports are probed in natural port order with a short timeout, so a
+        port without a Summit device costs about PROBE_TIMEOUT per try
+        rather than the full command timeout.
         """
         new_devs = []
-        dev_count = 0
         print "Checking serial ports for Summit RX devices..."
-        for dev in self:
-            if not dev['com'].connect():
-                continue
-            # Do a quick check for OUR_MAC0. Try to not flood the connected
-            # device with data, it may not be a Summit device.
+        devs = sorted(self.__devs, key=lambda dev: natural_key(dev['port']))
+
+        for dev in devs:
             prev_retry_count = self.get_retries()
             self.set_retries(1)
-            (rd_status, our_mac0) = dev.rd(0x403024)
-            self.set_retries(prev_retry_count)
-
-            if((rd_status == 0x01) & (our_mac0 == 0xEA02)):
-                (smd_status, smd) = dev.get_speaker_module_descriptor()
-                (sd_status, sd) = dev.get_speaker_descriptor()
-                logging.debug("smd_status: %d" % smd_status)
-                logging.debug("sd_status: %d" % sd_status)
-                logging.debug("smd.hardwareType: %d" % smd.hardwareType)
-                if((smd_status == 0x01) and (sd_status == 0x01)):
-                    major = smd.firmwareVersion >> 5   # (Upper 11-bits)
-                    minor = smd.firmwareVersion & 0x1f # (Lower 5-bits)
-                    dev['fw_major'] = major
-                    dev['fw_minor'] = minor
-                    dev['fw_version'] = "%d.%d" % (major, minor)
-                    dev['mac'] = ":".join(["%.2X" % i for i in smd.macAddress])
-                    dev['index'] = dev_count
-                    dev['speaker_type'] = sd.staticSpeakerType
-                    dev['type'] = 'slave'
-                    dev['module_id'] = smd.moduleID
-                    new_devs.append(self.__devs[self.__com_index])
-                    dev_count += 1
-                    self.start_logging()
-                    print "[%s] %s" % (colored('*', 'green'), dev['port'])
-                else:
-                    print "[ ] %s" % (dev['port'])
-                    dev['com'].write('\n\n')
-                    self.close()
+            try:
+                found = self._probe(dev)
+            finally:
+                self.set_retries(prev_retry_count)
+
+            if found and self._describe(dev):
+                dev['index'] = len(new_devs)
+                new_devs.append(dev)
+                dev.start_logging()
+                print "[%s] %s" % (colored('*', 'green'), dev['port'])
+            elif found:
+                print "[ ] %s" % (dev['port'])
+                dev['com'].write('\n\n')
+                dev.close()
             else:
                 logging.debug("Removing com %s" % dev['port'])
                 print "[ ] %s" % dev['port']
-                self.close()
+                dev.close()
 
-        return list(new_devs)
+        return new_devs
 
     @trace
     def get_timeout(self):
@@ -5095,9 +6060,10 @@ class RxAPI(API):
             dev['com'].close()
         self.__devs = []
         for com in coms:
-            self.__devs.append(
+            self.__devs.append(RxDevice(self,
                 {   'index': 0,
                     'com': com,
+                    'transport': UartTransport(com),
                     'port': com.target.port,
                     'fw_major': "0.0",
                     'fw_minor': "0.0",
@@ -5107,9 +6073,10 @@ class RxAPI(API):
                     'speaker_type': 0x00,
                     'logging': logging_enable,
                 }
-            )
+            ))
         if(prune_devs):
             self.__devs = self._prune_devs()
+        self._index_devs()
 
     @trace
     def get_port(self):
@@ -5223,76 +6190,6 @@ class RxAPI(API):
 #==============================================================================
 # Callback functions
 #==============================================================================
-    def _py_wr_func(self, mes):
-        status = 0x0
-        self['com'].lock_port()
-        try:
-            if(self['com'].isOpen()):
-                message = mes[0].to_pkt()
-                bytes_written = self['com'].write(message)
-                if(len(message) != bytes_written):
-                    status = 0xE1
-                else:
-                    status = 0
-        except:
-            raise
-        finally:
-            self['com'].unlock_port()
-
-        return status
-
-
-    def _py_rd_func(self, mes):
-        """Serial read method that searches for correct Summit protocol 1 byte
-        at a time.
-
-        """
-        self['com'].lock_port()
-        self['com'].target.flushInput()
-        message = mes[0].to_pkt()
-
-        bytes_written = self['com'].write(message)
-        if(len(message) != bytes_written):
-            self['com'].unlock_port()
-            return 0xE1
-        else:
-            status = 0
-
-        byte_count = 0
-        while(True): # Read until exception or return
-            byte = self['com'].read(1)  # Tries to read until timeout
-            if(len(byte) != 1):
-                return 0xE1
-
-            if(byte_count == 0):
-                if(ord(byte) == 0x01):
-                    message = byte
-                    byte_count += 1
-            elif(byte_count > 0):
-                if((ord(byte) == 0x01) & (ord(message[0]) == 0x01)):
-                    message += byte
-                    byte_count += 1
-                    message += self['com'].read(7)
-                    if(len(message) != 9):
-                        return 0xE2
-                    else:
-                        data_len = ord(message[7]) + (ord(message[8])<<8)
-                        message += self['com'].read(data_len)
-
-                        try:
-                            mes[0].from_pkt(message)
-                        except TargetPacketError as info:
-                            self['com'].unlock_port()
-                            return 0xE4
-                        except:
-                            raise
-                        if(len(message) != (data_len+9)):
-                            self['com'].unlock_port()
-                            return 0xE3 # READ_PAYLOAD_ERROR
-
-                        self['com'].unlock_port()
-                        return status
-
     def _py_open_func(self):
         return 0
 
@@ -6087,6 +6984,161 @@ class RxAPI(API):
 
         return(status, None)
 
+class _AsyncPort(object):
+    """
+    Runs calls for one port on an executor, one at a time, in call order
+
+    Each call waits for the executor work of the previous one, not for its
+    user visible future, so cancelling a call (e.g. by asyncio.wait_for)
+    never lets the next one start while work it already started is still
+    running. A call cancelled before it started is skipped. Calls for
+    different ports are queued independently.
+    """
+
+    def __init__(self, loop, executor):
+        self.loop = loop
+        self.executor = executor
+        self._tail = None
+
+    def submit(self, fn, *args, **kwargs):
+        result = asyncio.Future(loop=self.loop)
+        work = asyncio.Future(loop=self.loop) # done when this call's work has finished
+        previous = self._tail
+        self._tail = work
+
+        def finished(inner):
+            if not result.cancelled():
+                if inner.cancelled():
+                    result.cancel()
+                elif inner.exception() is not None:
+                    result.set_exception(inner.exception())
+                else:
+                    result.set_result(inner.result())
+            work.set_result(None)
+
+        def start(_=None):
+            if result.cancelled():
+                work.set_result(None)
+                return
+            inner = self.loop.run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+            inner.add_done_callback(finished)
+
+        def release(_):
+            if self._tail is work:
+                self._tail = None
+
+        work.add_done_callback(release)
+        if previous is None or previous.done():
+            start()
+        else:
+            previous.add_done_callback(start)
+        return result
+
+class _AsyncMethods(object):
+    """Exposes the public methods of an API object as future returning calls"""
+
+    def _call(self, name, *args, **kwargs):
+        raise NotImplementedError
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if not callable(getattr(self._api, name)):
+            raise AttributeError("%s is not an API method" % name)
+
+        def method(*args, **kwargs):
+            return self._call(name, *args, **kwargs)
+        method.__name__ = name
+        return method
+
+class AsyncTxAPI(_AsyncMethods):
+    """
+    asyncio facade over a TxAPI
+
+    Every public TxAPI method is available under the same name and returns
+    an asyncio future of its usual return value. Calls run on the loop's
+    executor (or the one given) and are serialised in call order, so one
+    event loop can drive the master alongside any number of slaves.
+    Requires asyncio (or trollius on Python 2).
+
+    | Example:
+    |  from pysummit.devices import TxAPI, AsyncTxAPI
+    |  tx = AsyncTxAPI(TxAPI())
+    |  (status, ns) = loop.run_until_complete(tx.netstat(0))
+    """
+
+    def __init__(self, tx, loop=None, executor=None):
+        if asyncio is None:
+            raise ImportError("AsyncTxAPI requires asyncio or trollius")
+        self._api = tx
+        self.loop = loop or asyncio.get_event_loop()
+        self._port = _AsyncPort(self.loop, executor)
+
+    def _call(self, name, *args, **kwargs):
+        return self._port.submit(getattr(self._api, name), *args, **kwargs)
+
+class _AsyncRxDevice(_AsyncMethods):
+    """One slave of an AsyncRxAPI; methods run with that slave selected"""
+
+    def __init__(self, parent, key):
+        self._api = parent._api
+        self._parent = parent
+        self._key = key
+
+    def _call(self, name, *args, **kwargs):
+        return self._parent._call_on(self._key, name, *args, **kwargs)
+
+class AsyncRxAPI(object):
+    """
+    asyncio facade over an RxAPI
+
+    Indexing by slave index or MAC returns a device whose RxAPI methods
+    return asyncio futures. Calls are serialised per serial port and queued
+    independently across ports; each call selects its slave in the executor
+    thread, whose RxAPI cursor is thread local. Requires asyncio (or
+    trollius on Python 2).
+
+    | Example:
+    |  from pysummit.devices import RxAPI, AsyncRxAPI
+    |  rx = AsyncRxAPI(RxAPI(coms))
+    |  (status, ns) = loop.run_until_complete(rx['02:EA:3F:00:0B:FC'].netstat(0))
+    |  results = loop.run_until_complete(rx.broadcast('netstat', 0))
+    """
+
+    def __init__(self, rx, loop=None, executor=None):
+        if asyncio is None:
+            raise ImportError("AsyncRxAPI requires asyncio or trollius")
+        self._api = rx
+        self.loop = loop or asyncio.get_event_loop()
+        self.executor = executor
+        self._ports = {}
+
+    def __len__(self):
+        return len(self._api)
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and not (0 <= index < len(self._api)):
+            raise IndexError
+        return _AsyncRxDevice(self, index)
+
+    def __iter__(self):
+        for index in range(len(self._api)):
+            yield self[index]
+
+    def _call_on(self, key, name, *args, **kwargs):
+        port = self._api[key]['port']
+        if port not in self._ports:
+            self._ports[port] = _AsyncPort(self.loop, self.executor)
+        api = self._api
+
+        def call():
+            return getattr(api[key], name)(*args, **kwargs)
+        return self._ports[port].submit(call)
+
+    def broadcast(self, method, *args, **kwargs):
+        """Returns a future of the list of every slave's result, in slave order"""
+        return asyncio.gather(*[getattr(dev, method)(*args, **kwargs) for dev in self])
+
 class SystemStatusError(Exception):
     def __init__(self, cmd, status):
         self.cmd = cmd
@@ -1,39 +1,729 @@
 from __future__ import division
+import os
 import sys
+import time
+import math
+import json
+import mmap
+import struct
 import logging
+import socket
+import argparse
 from pysummit import comport
 from pysummit import descriptors as desc
 #from pysummit import decoders as dec
 from pysummit.devices import TxAPI
 from pysummit.devices import RxAPI
+from pysummit.devices import Progress, LatencyHistogram, monotonic
 from pysummit.power_controller import PowerController
 from pysummit import testprofile
 from pysummit.bsp.pi_bsp import PiBSP
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 filename = "MG_echo_data.csv"
-
-# Format required to work as a ra script
-def main(TX, RX, tp=None, pc=None, args=[]):
+store_filename = "MG_echo_data.bin"
+
+class EchoResult(object):
+    """Per-echo status and timing of a single echo burst"""
+
+    def __init__(self, count):
+        self.statuses = [None] * count
+        self.latencies = [None] * count
+        self.targets = [None] * count
+        self.elapsed = 0.0
+
+    @property
+    def attempts(self):
+        """Number of echoes that were actually issued"""
+        return len(self.statuses) - self.statuses.count(None)
+
+    @property
+    def valid(self):
+        """Number of echoes that returned success (0x01)"""
+        return self.statuses.count(0x01)
+
+    @property
+    def rate(self):
+        """Achieved echoes per second"""
+        if self.elapsed > 0:
+            return self.attempts / self.elapsed
+        return 0.0
+
+    def errors(self):
+        """Returns a dict of failing status -> occurrence count"""
+        counts = {}
+        for status in self.statuses:
+            if status is not None and status != 0x01:
+                counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def slaves(self):
+        """Returns the sorted slave indexes that were echoed"""
+        return sorted(set(self.targets) - set([None]))
+
+    def slave_result(self, slave_index):
+        """Returns an EchoResult holding only the echoes sent to slave_index"""
+        seqs = [seq for (seq, target) in enumerate(self.targets) if target == slave_index]
+        result = EchoResult(len(seqs))
+        result.statuses = [self.statuses[seq] for seq in seqs]
+        result.latencies = [self.latencies[seq] for seq in seqs]
+        result.targets = [slave_index] * len(seqs)
+        result.elapsed = self.elapsed
+        return result
+
+    def histogram(self):
+        """Returns a LatencyHistogram of all issued echoes"""
+        hist = LatencyHistogram()
+        for latency in self.latencies:
+            if latency is not None:
+                hist.add(latency)
+        return hist
+
+class EchoEngine(object):
+    """
+    Issues echo bursts from the master to a slave
+
+    Echoes are issued one at a time; the master library is not reentrant,
+    so echoes cannot overlap on the bus.
+
+    | Arguments:
+    |  tx    -- TxAPI instance
+    |  rate  -- target echoes per second, None to run unthrottled
+    |  retry -- firmware retry count passed to TxAPI.echo()
+    """
+
+    def __init__(self, tx, rate=None, retry=1):
+        self.tx = tx
+        self.rate = rate
+        self.retry = retry
+
+    def run(self, count, slaves=0, stop=None):
+        """
+        Echo up to count times, returns an EchoResult
+
+        slaves is a slave index or a list of them; with several slaves the
+        echoes are interleaved round-robin across the list. stop is an
+        optional predicate called as stop(completed, failed) after every
+        echo; the burst ends early once it returns True.
+        """
+        if isinstance(slaves, int):
+            slaves = [slaves]
+        result = EchoResult(count)
+        progress = Progress('Echo', total=count)
+        failed = 0
+        start = monotonic()
+        for seq in range(count):
+            # Hold each echo back until its slot in the target rate
+            if self.rate:
+                delay = start + (seq / self.rate) - monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            slave_index = slaves[seq % len(slaves)]
+            result.targets[seq] = slave_index
+            sent = monotonic()
+            (status, null) = self.tx.echo(slave_index, retry=self.retry)
+            result.latencies[seq] = monotonic() - sent
+            result.statuses[seq] = status
+
+            progress.update()
+            if status != 0x01:
+                failed += 1
+            if stop is not None and stop(seq + 1, failed):
+                break
+        result.elapsed = monotonic() - start
+        progress.close()
+        return result
+
+def per_ci_stop(width, min_echoes=50, z=1.96):
+    """
+    Returns an EchoEngine stop predicate that ends a burst once the Wilson
+    interval of the echo failure rate is narrower than width (a fraction)
+    """
+    def stop(completed, failed):
+        if completed < min_echoes:
+            return False
+        (low, high) = wilson_interval(failed, completed, z)
+        return (high - low) < width
+    return stop
+
+def map_slaves(TX, RX, slaves):
+    """
+    Resolves the master's slave indexes to positions in RX
+
+    The master numbers slaves in enumeration order, which need not match
+    the order of the COM ports in RX, so each slave's MAC is read from the
+    master's copy of its module descriptor and looked up in RX. With a
+    single slave on a single port the two are taken to be the same device.
+
+    | Returns:
+    |  positions -- dict mapping slave index to RX position; slaves that
+    |               could not be resolved are left out
+    """
+    positions = {}
+    for slave_index in slaves:
+        (status, smd) = TX.get_speaker_module_descriptor(slave_index, 1)
+        if (status != 0x01):
+            print TX.decode_error_status(status, "get_speaker_module_descriptor(%d, 1)" % slave_index)
+            continue
+        mac = ":".join(["%.2X" % i for i in smd.macAddress])
+        position = RX.index(mac)
+        if position is None:
+            print "Slave %d (%s) is not on any RX port, leaving it out of the PER summary" % (slave_index, mac)
+        else:
+            positions[slave_index] = position
+    if not positions and len(slaves) == 1 and len(RX) == 1:
+        positions[slaves[0]] = 0
+    return positions
+
+#==============================================================================
+# Statistics
+#==============================================================================
+# One netstat snapshot. device 0 is the master, 1..n are the slaves in RX order
+NETSTAT_DTYPE = [
+    ('iteration', 'u4'),
+    ('device', 'u2'),
+    ('status', 'u1'),
+    ('attempts', 'u4'),
+    ('packets', 'u4', (4,)),
+]
+
+def wilson_interval(errors, trials, z=1.96):
+    """
+    Wilson score interval for an error rate of errors/trials
+
+    Works element-wise on NumPy arrays as well as on scalars; trials must
+    be non-zero.
+
+    | Returns:
+    |  (low, high) -- interval bounds as fractions
+    """
+    p = errors / trials
+    z2 = z * z
+    denom = 1. + z2 / trials
+    centre = (p + z2 / (2. * trials)) / denom
+    half = z * (p * (1. - p) / trials + z2 / (4. * trials * trials)) ** 0.5 / denom
+    return (centre - half, centre + half)
+
+class NetstatLog(object):
+    """
+    Netstat snapshots of the master and every slave across all iterations
+
+    Snapshots are kept as plain tuples while the test runs and turned into
+    a NumPy structured array (NETSTAT_DTYPE) for the end of run summary,
+    which is computed in one vectorized pass.
+    """
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.rows = []
+
+    def add(self, iteration, device, status, attempts, ns_struct):
+        packets = tuple(ns_struct.PacketReceiveErrors[i] for i in range(4))
+        self.rows.append((iteration, device, status, attempts, packets))
+
+    def array(self):
+        return np.array(self.rows, dtype=NETSTAT_DTYPE)
+
+    def summary(self, z=1.96):
+        """
+        Computes TxPER/RxPER per slave over all iterations
+
+        TxPER is the fraction of echoes a slave never received, RxPER the
+        fraction of echoes a slave received whose reply never made it back
+        to the master. When several slaves were echoed the master's receive
+        count is shared out in proportion to the echoes sent to each slave.
+        Slaves that were never echoed are left out, and iterations where the
+        netstat query of the master or of an echoed slave failed are skipped.
+
+        | Returns:
+        |  list of dicts, one per echoed slave, with counts, PERs and
+        |  confidence intervals (fractions)
+        """
+        a = self.array()
+        if len(a) == 0:
+            return []
+        iterations = np.unique(a['iteration'])
+        devices = int(a['device'].max()) + 1
+        row = np.searchsorted(iterations, a['iteration'])
+
+        received = np.zeros((len(iterations), devices))
+        attempts = np.zeros((len(iterations), devices))
+        ok = np.zeros((len(iterations), devices), dtype=bool)
+        received[row, a['device']] = a['packets'].sum(axis=1)
+        attempts[row, a['device']] = a['attempts']
+        ok[row, a['device']] = (a['status'] == 0x01)
+
+        valid = ok[:, 0] & (ok[:, 1:] | (attempts[:, 1:] == 0)).all(axis=1)
+        total_sent = max(attempts[valid, 0].sum(), 1)
+        sent = attempts[valid, 1:].sum(axis=0)
+        returned = received[valid, 0].sum() * sent / total_sent
+        slave_received = received[valid, 1:].sum(axis=0)
+
+        tx_errors = np.clip(sent - slave_received, 0, None)
+        rx_errors = np.clip(slave_received - returned, 0, None)
+        tx_trials = np.maximum(sent, 1)
+        rx_trials = np.maximum(slave_received, 1)
+        (tx_low, tx_high) = wilson_interval(tx_errors, tx_trials, z)
+        (rx_low, rx_high) = wilson_interval(rx_errors, rx_trials, z)
+
+        summary = []
+        for slave in range(devices - 1):
+            if sent[slave] == 0:
+                continue
+            summary.append({
+                'label': self.labels[slave + 1],
+                'iterations': int(valid.sum()),
+                'sent': int(sent[slave]),
+                'received': int(slave_received[slave]),
+                'returned': int(round(returned[slave])),
+                'tx_per': tx_errors[slave] / tx_trials[slave],
+                'tx_ci': (tx_low[slave], tx_high[slave]),
+                'rx_per': rx_errors[slave] / rx_trials[slave],
+                'rx_ci': (rx_low[slave], rx_high[slave]),
+            })
+        return summary
+
+    def report(self, z=1.96):
+        if np is None:
+            print "numpy is not installed, skipping run summary"
+            return
+        print "Run summary (%d%% confidence):" % round(100 * math.erf(z / math.sqrt(2)))
+        for entry in self.summary(z):
+            print "  %s: %d/%d received over %d iterations" % (
+                entry['label'], entry['received'], entry['sent'], entry['iterations'])
+            print "    TxPER %.3f%% [%.3f%%, %.3f%%]  RxPER %.3f%% [%.3f%%, %.3f%%]" % (
+                100 * entry['tx_per'], 100 * entry['tx_ci'][0], 100 * entry['tx_ci'][1],
+                100 * entry['rx_per'], 100 * entry['rx_ci'][0], 100 * entry['rx_ci'][1])
+
+#==============================================================================
+# Checkpointing
+#==============================================================================
+class Checkpoint(object):
+    """
+    Records every completed iteration of a sweep so it can be resumed
+
+    The checkpoint is a JSON file, rewritten atomically after each
+    iteration, holding the test configuration and, per completed iteration,
+    the attenuation step, the counters written to the CSV, the per-slave
+    echo counters and the raw netstat snapshots.
+    """
+
+    def __init__(self, path, config):
+        self.path = path
+        # Round trip through JSON so tuples compare equal to a loaded copy
+        self.config = json.loads(json.dumps(config))
+        self.iterations = []
+
+    def load(self):
+        """
+        Loads the completed iterations of a previous run of the same
+        configuration. Returns False if there is nothing to resume.
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r') as f:
+            state = json.load(f)
+        if state.get('config') != self.config:
+            logging.error("%s was written by a different test configuration" % self.path)
+            return False
+        self.iterations = state.get('iterations', [])
+        return True
+
+    def add(self, record):
+        self.iterations.append(record)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'config': self.config, 'iterations': self.iterations}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+#==============================================================================
+# Binary result store
+#==============================================================================
+# File layout: a STORE_HEADER followed by fixed size records. Each run starts
+# with a RUN_RECORD followed by one ITERATION_RECORD per iteration; both are
+# RECORD_SIZE bytes. A run's entry is appended to the '.idx' file when the run
+# ends. Runs that never ended (e.g. console died) are found by scanning the
+# records after the last indexed run.
+STORE_MAGIC = 'MGER'
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct('<4sHH8x')
+RUN_RECORD = struct.Struct('<BBHIdIIf20x')
+ITERATION_RECORD = struct.Struct('<BBHIIfIIIIIIII')
+INDEX_ENTRY = struct.Struct('<IIdQQ')
+RECORD_SIZE = ITERATION_RECORD.size
+RECORD_RUN = 1
+RECORD_ITERATION = 2
+RUN_RESUMED = 0x01
+
+ITERATION_DTYPE = [
+    ('kind', 'u1'),
+    ('flags', 'u1'),
+    ('slaves', '<u2'),
+    ('run_id', '<u4'),
+    ('iteration', '<u4'),
+    ('attenuation', '<f4'),
+    ('echoes', '<u4'),
+    ('valid', '<u4'),
+    ('tx', '<u4'),
+    ('rx', '<u4'),
+    ('p50_us', '<u4'),
+    ('p90_us', '<u4'),
+    ('p99_us', '<u4'),
+    ('max_us', '<u4'),
+]
+
+class ResultStore(object):
+    """
+    Append-only binary store of echo test results
+
+    Every record is RECORD_SIZE bytes, so readers can memory-map the file
+    and slice a run by record number using the run index instead of parsing
+    text. run_id is the record number of the run's RUN_RECORD.
+
+    | Example:
+    |  store = ResultStore('MG_echo_data.bin')
+    |  for run in store.runs():
+    |      records = store.run(run['run_id'])
+    |      print run['run_id'], records['tx'].sum()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.splitext(path)[0] + '.idx'
+        self.__run = None
+
+    def _record_count(self):
+        if not os.path.exists(self.path):
+            return 0
+        return max(os.path.getsize(self.path) - STORE_HEADER.size, 0) // RECORD_SIZE
+
+    def _append(self, record):
+        with open(self.path, 'ab') as f:
+            f.write(record)
+
+    def begin_run(self, slaves, iterations, echoes, ci_width=None, resumed=False):
+        """Writes the run header, returns the run_id"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            with open(self.path, 'wb') as f:
+                f.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, RECORD_SIZE))
+        else:
+            with open(self.path, 'r+b') as f:
+                (magic, version, record_size) = STORE_HEADER.unpack(f.read(STORE_HEADER.size))
+                if (magic != STORE_MAGIC) or (record_size != RECORD_SIZE):
+                    raise IOError("%s is not an echo result store" % self.path)
+                # Drop a record torn by an interrupted write
+                f.truncate(STORE_HEADER.size + self._record_count() * RECORD_SIZE)
+
+        run_id = self._record_count()
+        self.__run = {'run_id': run_id, 'start': time.time(), 'iterations': 0}
+        self._append(RUN_RECORD.pack(RECORD_RUN, RUN_RESUMED if resumed else 0,
+            slaves, run_id, self.__run['start'], iterations, echoes, ci_width or 0.0))
+        return run_id
+
+    def add(self, slaves, iteration, attenuation, echoes, valid, tx, rx, latency):
+        """Appends one iteration record, latency is a LatencyHistogram"""
+        self._append(ITERATION_RECORD.pack(RECORD_ITERATION, 0, slaves,
+            self.__run['run_id'], iteration,
+            float('nan') if attenuation is None else attenuation,
+            echoes, valid, tx, rx,
+            int(latency.percentile(50) * 1e6), int(latency.percentile(90) * 1e6),
+            int(latency.percentile(99) * 1e6), int(latency.max * 1e6)))
+        self.__run['iterations'] += 1
+
+    def end_run(self):
+        """Appends the run's entry to the index"""
+        run = self.__run
+        with open(self.index_path, 'ab') as f:
+            f.write(INDEX_ENTRY.pack(run['run_id'], run['iterations'], run['start'],
+                run['run_id'], self._record_count() - run['run_id']))
+        self.__run = None
+
+    def runs(self):
+        """
+        Returns a list of dicts (run_id, iterations, start, first, count)
+        describing every run, including runs missing from the index
+        """
+        runs = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+            for offset in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+                (run_id, iterations, start, first, count) = INDEX_ENTRY.unpack_from(data, offset)
+                runs.append({'run_id': run_id, 'iterations': iterations, 'start': start,
+                             'first': first, 'count': count})
+
+        # Recover runs that were started but never ended from the records
+        # not covered by the index
+        recovered = []
+        indexed_end = 0
+        for run in runs + [{'first': self._record_count(), 'count': 0}]:
+            if indexed_end < run['first']:
+                recovered.extend(self._scan(indexed_end, run['first']))
+            indexed_end = run['first'] + run['count']
+        return sorted(runs + recovered, key=lambda run: run['first'])
+
+    def _scan(self, first, last):
+        runs = []
+        with open(self.path, 'rb') as f:
+            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for record in range(first, last):
+                    offset = STORE_HEADER.size + record * RECORD_SIZE
+                    if ord(view[offset]) == RECORD_RUN:
+                        start = RUN_RECORD.unpack_from(view, offset)[4]
+                        runs.append({'run_id': record, 'iterations': 0, 'start': start,
+                                     'first': record, 'count': 1})
+                    elif runs:
+                        runs[-1]['iterations'] += 1
+                        runs[-1]['count'] += 1
+            finally:
+                view.close()
+        return runs
+
+    def records(self):
+        """Returns all records memory-mapped as a NumPy ITERATION_DTYPE array"""
+        count = self._record_count()
+        if count == 0:
+            return np.zeros(0, dtype=ITERATION_DTYPE)
+        return np.memmap(self.path, dtype=ITERATION_DTYPE, mode='r',
+                         offset=STORE_HEADER.size, shape=(count,))
+
+    def run(self, run_id):
+        """
+        Returns the iteration records of one run: a NumPy array when NumPy
+        is available, otherwise a list of ITERATION_RECORD tuples
+        """
+        for run in self.runs():
+            if run['run_id'] == run_id:
+                break
+        else:
+            raise KeyError(run_id)
+
+        (first, last) = (run['first'] + 1, run['first'] + run['count'])
+        if np is not None:
+            return self.records()[first:last]
+        with open(self.path, 'rb') as f:
+            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return [ITERATION_RECORD.unpack_from(view, STORE_HEADER.size + record * RECORD_SIZE)
+                        for record in range(first, last)]
+            finally:
+                view.close()
+
+#==============================================================================
+# Attenuation sweep
+#==============================================================================
+def load_schedule(path):
+    """
+    Reads an attenuation sweep schedule
+
+    Each non-blank line holds an attenuation value (dB) and a dwell time in
+    seconds, separated by whitespace or a comma. The dwell is how long to
+    let the link settle after setting the attenuation before measuring.
+    '#' starts a comment.
+
+    | Returns:
+    |  schedule -- list of (attenuation, dwell) tuples
+    """
+    schedule = []
+    with open(path, 'r') as f:
+        for (line_num, line) in enumerate(f, 1):
+            line = line.split('#')[0].replace(',', ' ').strip()
+            if not line:
+                continue
+            fields = line.split()
+            if len(fields) > 2:
+                raise ValueError("%s:%d: expected '<attenuation> [dwell]'" % (path, line_num))
+            attenuation = float(fields[0])
+            dwell = float(fields[1]) if len(fields) > 1 else 0.0
+            schedule.append((attenuation, dwell))
+    return schedule
+
+class ManualAttenuator(object):
+    """Asks the operator to set each attenuation value by hand"""
+
+    def set(self, value):
+        if value is None:
+            raw_input("Set next attenuation value. Hit <Enter> to continue. ")
+        else:
+            raw_input("Set attenuation to %g dB. Hit <Enter> to continue. " % value)
+
+    def close(self):
+        pass
+
+class FileAttenuator(object):
+    """Writes each attenuation value to a file watched by a local stand-in"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def set(self, value):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write("%g\n" % value)
+        os.rename(tmp_path, self.path)
+
+    def close(self):
+        pass
+
+class SocketAttenuator(object):
+    """
+    Drives a network attenuator (or a local stand-in) over TCP
+
+    Sends 'ATT <value>' lines and expects a reply line starting with 'OK'.
+    """
+
+    def __init__(self, address, timeout=10):
+        (host, port) = address.rsplit(':', 1)
+        self.address = (host or 'localhost', int(port))
+        self.timeout = timeout
+        self.__sock = None
+        self.__reply = None
+
+    def set(self, value):
+        if self.__sock is None:
+            self.__sock = socket.create_connection(self.address, self.timeout)
+            self.__reply = self.__sock.makefile('r')
+        self.__sock.sendall("ATT %g\n" % value)
+        reply = self.__reply.readline().strip()
+        if not reply.upper().startswith('OK'):
+            raise IOError("attenuator rejected %g dB: %r" % (value, reply))
+
+    def close(self):
+        if self.__sock is not None:
+            self.__reply.close()
+            self.__sock.close()
+            self.__sock = None
+
+ATTENUATORS = {
+    'manual': ManualAttenuator,
+    'file': FileAttenuator,
+    'socket': SocketAttenuator,
+}
+
+def make_attenuator(spec):
+    """
+    Builds an attenuator driver from a '<driver>[:<argument>]' spec,
+    e.g. 'manual', 'file:/tmp/attenuation' or 'socket:localhost:5025'
+    """
+    (name, sep, argument) = spec.partition(':')
+    if name not in ATTENUATORS:
+        raise ValueError("unknown attenuator %r (choose from %s)" % (name, ", ".join(sorted(ATTENUATORS))))
+    if argument:
+        return ATTENUATORS[name](argument)
+    return ATTENUATORS[name]()
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog='mg_echo_test',
+        description="Echo packet error rate test.")
+    parser.add_argument('iterations', nargs='?', type=int, default=5,
+        help="number of times to iterate the full echo test")
+    parser.add_argument('--echoes', type=int, default=500,
+        help="number of echoes per slave per iteration (the maximum with --ci-width)")
+    parser.add_argument('--all-slaves', action='store_true',
+        help="echo every slave the master reports, round-robin, instead of slave 0")
+    parser.add_argument('--ci-width', type=float, default=None,
+        help="stop each burst early once the PER confidence interval is narrower than this (%%)")
+    parser.add_argument('--min-echoes', type=int, default=50,
+        help="minimum number of echoes per iteration with --ci-width")
+    parser.add_argument('--rate', type=float, default=None,
+        help="target echoes per second")
+    parser.add_argument('--schedule', default=None,
+        help="attenuation sweep schedule file, runs unattended")
+    parser.add_argument('--attenuator', default='manual',
+        help="attenuator driver: manual, file:<path> or socket:<host>:<port>")
+    parser.add_argument('--store', default=store_filename,
+        help="binary result store appended to alongside the CSV")
+    parser.add_argument('--checkpoint', default="MG_echo_checkpoint.json",
+        help="file recording each completed iteration")
+    parser.add_argument('--resume', action='store_true',
+        help="continue an interrupted run from its checkpoint")
+    try:
+        the_args = parser.parse_args(args)
+        # Only the manual driver can be asked for the next step without a value
+        if the_args.attenuator.partition(':')[0] != 'manual' and not the_args.schedule:
+            parser.error("--attenuator %s requires --schedule" % the_args.attenuator)
+        return the_args
+    except SystemExit as info:
+        return None
+
+def sweep(TX, RX, the_args, schedule, attenuator):
+    """Runs the echo test once per step of the attenuation schedule"""
+
+    # Slave indexes to echo
+    slaves = [0]
+    if the_args.all_slaves:
+        (status, slave_count) = TX.slave_count()
+        if (status != 0x01):
+            print TX.decode_error_status(status, "slave_count()"), "-- echoing slave 0 only"
+        elif (slave_count > 0):
+            slaves = range(slave_count)
+
+    # RX device each slave index refers to, for the per-slave netstat counters
+    positions = map_slaves(TX, RX, slaves)
+
+    checkpoint = Checkpoint(the_args.checkpoint, {
+        'schedule': schedule,
+        'echoes': the_args.echoes,
+        'ci_width': the_args.ci_width,
+        'min_echoes': the_args.min_echoes,
+        'slaves': slaves,
+        'devices': [TX['mac']] + [rx['mac'] for rx in RX],
+    })
+    if the_args.resume and checkpoint.load():
+        print "Resuming after %d completed iterations" % len(checkpoint.iterations)
 
     with open(filename, 'a') as f:
         # Data file headings
-        f.write("------------------\niteration,tx,rx\n")
+        if checkpoint.iterations:
+            f.write("------------------ resumed at iteration %d\n" % len(checkpoint.iterations))
+        else:
+            f.write("------------------\niteration,tx,rx,p50_ms,p90_ms,p99_ms,max_ms,attenuation,echoes\n")
         f.flush()
 
         # Number of packets to echo
-        echo_attempts = 500
+        echo_attempts = the_args.echoes
 
         # Set the number of times to iterate the full echo test
-        if (args):
-            iterations = int(args[0])
+        iterations = len(schedule)
+
+        engine = EchoEngine(TX, rate=the_args.rate, retry=1)
+        if the_args.ci_width:
+            stop = per_ci_stop(the_args.ci_width / 100., the_args.min_echoes)
         else:
-            iterations = 5
+            stop = None
+        store = ResultStore(the_args.store)
+        store.begin_run(len(slaves), iterations, echo_attempts, the_args.ci_width,
+                        resumed=bool(checkpoint.iterations))
+
+        netstats = NetstatLog([TX['mac']] + [rx['mac'] for rx in RX])
+        for record in checkpoint.iterations:
+            for (it, device, status, attempts, packets) in record['netstats']:
+                netstats.rows.append((it, device, status, attempts, tuple(packets)))
 
         # Echo tests start here
-        for iteration in range(iterations):
+        for iteration in range(len(checkpoint.iterations), iterations):
 
             # Adjust attenuation
-            a = raw_input("Set next attenuation value. Hit <Enter> to continue. ")
+            (attenuation, dwell) = schedule[iteration]
+            a = None
+            if attenuation is None:
+                attenuator.set(None)
+            else:
+                print "Setting attenuation to %g dB (dwell %gs)..." % (attenuation, dwell)
+                attenuator.set(attenuation)
+                time.sleep(dwell)
 
             # Turn off SpeakerKeeper because it broadcasts extra packets that mess up echo stats(?)
             print "Turning off SpeakerKeeper..."
@@ -49,26 +739,41 @@ def main(TX, RX, tp=None, pc=None, args=[]):
 
             # Reset all slave statistics
             print "Resetting all slave net statistics..."
-            for rx in RX:
-                (status, null) = rx.netstat(1)
+            for (status, null) in RX.broadcast('netstat', 1):
                 if (status != 0x01):
-                    print "\n", rx.decode_error_status(status, "netstat(1)")
+                    print "\n", RX.decode_error_status(status, "netstat(1)")
 
-            # Echo to slave index 0
+            # Echo to each slave index in turn
             print "Performing echo test..."
-            for echo_count in range(echo_attempts):
-                sys.stdout.write(".")
-                sys.stdout.flush()
-                (status, null) = TX.echo(0, retry=1)
-                if (status != 0x01):
-                    print "\n", TX.decode_error_status(status, "echo(0, retry=1)")
+            result = engine.run(echo_attempts * len(slaves), slaves=slaves, stop=stop)
+            print "%d echoes in %.2fs (%.1f echoes/s)" % (result.attempts, result.elapsed, result.rate)
+            if (result.attempts < echo_attempts * len(slaves)):
+                print "PER confidence target reached after %d of %d echoes" % (
+                    result.attempts, echo_attempts * len(slaves))
+            for slave_index in result.slaves():
+                slave_result = result.slave_result(slave_index)
+                slave_latency = slave_result.histogram()
+                if (len(slaves) > 1):
+                    print "Slave %d: %d/%d echoes, p50 %.3f ms, p99 %.3f ms" % (
+                        slave_index, slave_result.valid, slave_result.attempts,
+                        slave_latency.percentile(50) * 1e3, slave_latency.percentile(99) * 1e3)
+                for (status, count) in sorted(slave_result.errors().items()):
+                    print TX.decode_error_status(status, "echo(%d, retry=1)" % slave_index), "x %d" % count
+            latency = result.histogram()
+            # Echoes sent to each RX device; devices that were not echoed get 0
+            rx_attempts = [0] * len(RX)
+            for slave_index in result.slaves():
+                if slave_index in positions:
+                    rx_attempts[positions[slave_index]] += result.slave_result(slave_index).attempts
 
             # Get netstat from master
+            first_snapshot = len(netstats.rows)
             print "Querying net statistics from master..."
             (status, ns_struct) = TX.netstat(0)
             if (status != 0x01):
                 print TX.decode_error_status(status, "netstat(0)")
             print "\nTx netstat:\n", ns_struct
+            netstats.add(iteration, 0, status, result.attempts, ns_struct)
 
             tx_totalPackets = 0
             for i in range(4):
@@ -78,11 +783,12 @@ def main(TX, RX, tp=None, pc=None, args=[]):
 
             # Get netstat from slaves
             print "Querying net statistics from slaves..."
-            for rx in RX:
-                (status, ns_struct) = rx.netstat(0)
+            for (slave, (status, ns_struct)) in enumerate(RX.broadcast('netstat', 0)):
                 if (status != 0x01):
-                    print rx.decode_error_status(status, "netstat(0)")
+                    print RX.decode_error_status(status, "netstat(0)")
                 print "\nRx netstat:\n", ns_struct
+                netstats.add(iteration, slave + 1, status, rx_attempts[slave], ns_struct)
+                slave_attempts = rx_attempts[slave]
 
 
                 rx_totalPackets = 0
@@ -98,21 +804,70 @@ def main(TX, RX, tp=None, pc=None, args=[]):
             if (status != 0x01):
                 print "\n", TX.decode_error_status(status, "keep(1)")
 
-            f.write('%d,%d,%d\n' % (iteration, tx_totalPackets, rx_totalPackets))
+            f.write('%d,%d,%d,%.3f,%.3f,%.3f,%.3f,%s,%d\n' % (iteration, tx_totalPackets, rx_totalPackets,
+                latency.percentile(50) * 1e3, latency.percentile(90) * 1e3,
+                latency.percentile(99) * 1e3, latency.max * 1e3,
+                '' if attenuation is None else '%g' % attenuation,
+                result.attempts))
             f.flush()
-
-            print "echo_attempts: ", echo_attempts
+            store.add(len(slaves), iteration, attenuation, result.attempts, result.valid,
+                      tx_totalPackets, rx_totalPackets, latency)
+
+            checkpoint.add({
+                'iteration': iteration,
+                'attenuation': attenuation,
+                'tx': tx_totalPackets,
+                'rx': rx_totalPackets,
+                'echoes': result.attempts,
+                'latency_ms': [latency.percentile(50) * 1e3, latency.percentile(90) * 1e3,
+                               latency.percentile(99) * 1e3, latency.max * 1e3],
+                'slaves': dict((slave_index, [result.slave_result(slave_index).valid,
+                                              result.slave_result(slave_index).attempts])
+                               for slave_index in result.slaves()),
+                'netstats': netstats.rows[first_snapshot:],
+            })
+
+            print "echo_attempts: ", result.attempts
             print "rx_totalPackets: ", rx_totalPackets
             print "tx_totalPackets: ", tx_totalPackets
-            print "TxPER: ", 100.*(1.-(float(rx_totalPackets)/echo_attempts)), "%"
+            print "Echo latency (ms): p50 %.3f  p90 %.3f  p99 %.3f  max %.3f" % (
+                latency.percentile(50) * 1e3, latency.percentile(90) * 1e3,
+                latency.percentile(99) * 1e3, latency.max * 1e3)
+            if (slave_attempts > 0):
+                print "TxPER: ", 100.*(1.-(float(rx_totalPackets)/slave_attempts)), "%"
             if (rx_totalPackets > 0):
                 print "RxPER: ", 100.*(1.-(float(tx_totalPackets)/rx_totalPackets)), "%"
 
-            if ((iterations > 1) and (iteration+1 < iterations)):
+            if ((not the_args.schedule) and (iterations > 1) and (iteration+1 < iterations)):
                 a = raw_input("Do you want to continue (Y/n)? ")
             if (a and (a[0]=="N" or a[0]=="n")):
                 break
 
+        store.end_run()
+        netstats.report()
+
+    if (len(checkpoint.iterations) == iterations):
+        checkpoint.remove()
+
+# Format required to work as a ra script
+def main(TX, RX, tp=None, pc=None, args=[]):
+
+    the_args = parse_args(args)
+    if the_args is None:
+        return
+
+    # An attenuation schedule runs the sweep unattended, one step per iteration
+    if the_args.schedule:
+        schedule = load_schedule(the_args.schedule)
+    else:
+        schedule = [(None, 0.0)] * the_args.iterations
+    attenuator = make_attenuator(the_args.attenuator)
+
+    try:
+        sweep(TX, RX, the_args, schedule, attenuator)
+    finally:
+        attenuator.close()
+
 if __name__ == '__main__':
 
 	# Set up logging to a file and the console